@@ -35,18 +35,37 @@ class App(hassapi.Hass):
         version = "0.0.0"
         config_schema = None  # type: T.Optional[T.Callable]
 
+    def is_logged(self, level: str) -> bool:
+        """Tells whether messages of the given level are logged at all.
+        DEBUG messages are only logged when the debug config option
+        is enabled. Use this to avoid building expensive log messages
+        that would be discarded anyway."""
+
+        if level.upper() == "DEBUG":
+            return bool(self.args and self.args.get("debug"))
+        return True
+
     def log(  # pylint: disable=arguments-differ
-            self, msg: str, level: str = "INFO",
+            self, msg: str, *args: T.Any, level: str = "INFO",
             prefix: T.Optional[str] = None
     ) -> None:
         """Wrapper around super().log() which changes the log level
-        from DEBUG to INFO if debug config option is enabled.
-        It also adds an appropriate prefix to the log message."""
+        from DEBUG to INFO if debug config option is enabled and drops
+        DEBUG messages otherwise.
+        It also adds an appropriate prefix to the log message.
+        If args are given, msg is a format string which is formatted
+        with them only if the message is actually logged."""
+
+        if not self.is_logged(level):
+            return
 
         level = level.upper()
-        if level == "DEBUG" and self.args and self.args.get("debug"):
+        if level == "DEBUG":
             level = "INFO"
 
+        if args:
+            msg = msg.format(*args)
+
         if prefix is None:
             if level in ("DEBUG", "INFO"):
                 prefix = LOG_PREFIX_STATUS
@@ -8,14 +8,20 @@ import typing as T
 import types  # pylint: disable=unused-import
 if T.TYPE_CHECKING:
     # pylint: disable=cyclic-import,unused-import
+    import uuid
+    from concurrent import futures
     from .room import Room
     from .stats import StatisticsZone
 
+import concurrent.futures
+import fnmatch
 import importlib
-import inspect
 
 from .. import common
-from . import __version__, config, expr, util
+from . import (
+    __version__, batcher, config, expr, retry, scheduling, store, util,
+    workqueue
+)
 
 
 __all__ = ["HeatyApp"]
@@ -24,6 +30,8 @@ __all__ = ["HeatyApp"]
 class HeatyApp(common.App):
     """The Heaty app class for AppDaemon."""
 
+    # pylint: disable=too-many-instance-attributes
+
     class Meta(common.App.Meta):
         # pylint: disable=missing-docstring
         name = "heaty"
@@ -34,8 +42,28 @@ class HeatyApp(common.App):
         self.app = self
         self.cfg = None
         self.rooms = []  # type: T.List[Room]
+        self._rooms_by_name = {}  # type: T.Dict[str, Room]
         self.stats_zones = []  # type: T.List[StatisticsZone]
         self.temp_expression_modules = {}  # type: T.Dict[str, types.ModuleType]
+        self.evaluation_executor = None  # type: T.Optional[futures.ThreadPoolExecutor]
+        self.io_executor = None  # type: T.Optional[futures.ThreadPoolExecutor]
+        self._master_is_on = True
+        self.scheduling_timer = scheduling.SchedulingTimer(self)
+        self.state_store = None  # type: T.Optional[store.StateStore]
+        self.stored_state = {}  # type: T.Dict[str, T.Any]
+        # heaty_reschedule and heaty_set_temp events are queued and
+        # merged per room before being processed together
+        self._queued_reschedules = {}  # type: T.Dict[Room, bool]
+        self._queued_set_temps = {}  # type: T.Dict[Room, T.Dict[str, T.Any]]
+        self._event_queue_timer = None  # type: T.Optional[uuid.UUID]
+        self.event_queue_stats = {"queued": 0, "merged": 0}
+        self.evaluation_stats = {"evaluated": 0, "shared": 0, "skipped": 0}
+        self.thermostat_state_stats = {"handled": 0, "filtered": 0}
+        # callbacks not belonging to a single room are serialized
+        # through this queue, work for rooms through the rooms' queues
+        self.work_queue = workqueue.WorkQueue(self.log)
+        self.service_batcher = batcher.ServiceCallBatcher(self)
+        self.retry_scheduler = retry.RetryScheduler(self)
         super().__init__(*args, **kwargs)
 
     def initialize_inner(self) -> None:
@@ -49,6 +77,8 @@ class HeatyApp(common.App):
         if heaty_id != "default":
             heaty_id_kwargs["heaty_id"] = heaty_id
 
+        self._rooms_by_name = {room.name: room for room in self.rooms}
+
         self.log("Importing modules for use in temperature expressions.",
                  level="DEBUG")
         for mod_name, mod_data in self.cfg["temp_expression_modules"].items():
@@ -66,40 +96,238 @@ class HeatyApp(common.App):
             else:
                 self.temp_expression_modules[as_name] = mod
 
+        threads = self.cfg["evaluation_threads"]
+        if threads > 1:
+            self.log("Evaluating schedules of independent rooms in up to "
+                     "{} threads.".format(threads),
+                     level="DEBUG")
+            self.evaluation_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=threads
+            )
+
+        threads = self.cfg["io_threads"]
+        if threads > 1:
+            self.log("Sending independent requests to Home Assistant in "
+                     "up to {} threads.".format(threads),
+                     level="DEBUG")
+            self.io_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=threads
+            )
+
+        if self.cfg["state_store"]:
+            self.log("Loading state store from {}."
+                     .format(repr(self.cfg["state_store"])),
+                     level="DEBUG")
+            self.state_store = store.StateStore(self.cfg["state_store"])
+            try:
+                self.stored_state = self.state_store.load()
+            except store.StoreError as err:
+                self.log("Error while loading the state store: {}"
+                         .format(err),
+                         level="ERROR")
+                self.log("State won't be persisted.", level="ERROR")
+                self.state_store = None
+
+        # a single request for all states, which are used for
+        # initializing all rooms, thermostats and window sensors and
+        # for the first scheduling pass
+        self.log("Fetching initial states of all entities.",
+                 level="DEBUG")
+        states = self.get_state() or {}
+
+        master = self.cfg["master_switch"]
+        if master:
+            self._master_is_on = \
+                states.get(master, {}).get("state") == "on"
+            self.log("Master switch (entity_id={}) is {}."
+                     .format(repr(master),
+                             "on" if self._master_is_on else "off"),
+                     level="DEBUG")
+
         for room in self.rooms:
-            room.initialize()
+            for therm in room.thermostats:
+                therm.initialize(states.get(therm.entity_id))
+            room.initialize(states)
 
         self.log("Listening for heaty_reschedule event.",
                  level="DEBUG")
-        self.listen_event(self._reschedule_event_cb, "heaty_reschedule",
+        self.listen_event(self.work_queue.wrap(self._reschedule_event_cb),
+                          "heaty_reschedule",
                           **heaty_id_kwargs)
 
         self.log("Listening for heaty_set_temp event.",
                  level="DEBUG")
-        self.listen_event(self._set_temp_event_cb, "heaty_set_temp",
+        self.listen_event(self.work_queue.wrap(self._set_temp_event_cb),
+                          "heaty_set_temp",
+                          **heaty_id_kwargs)
+
+        self.log("Listening for heaty_set_temps event.",
+                 level="DEBUG")
+        self.listen_event(self.work_queue.wrap(self._set_temps_event_cb),
+                          "heaty_set_temps",
+                          **heaty_id_kwargs)
+
+        endpoint = "heaty_{}_set_temps".format(heaty_id)
+        self.log("Registering API endpoint {}.".format(repr(endpoint)),
+                 level="DEBUG")
+        self.register_endpoint(self._set_temps_endpoint_cb, endpoint)
+
+        endpoint = "heaty_{}_status".format(heaty_id)
+        self.log("Registering API endpoint {}.".format(repr(endpoint)),
+                 level="DEBUG")
+        self.register_endpoint(self._status_endpoint_cb, endpoint)
+
+        self.log("Listening for heaty_dump_trace event.",
+                 level="DEBUG")
+        self.listen_event(self.work_queue.wrap(self._dump_trace_event_cb),
+                          "heaty_dump_trace",
                           **heaty_id_kwargs)
 
-        master = self.cfg["master_switch"]
         if master:
             self.log("Listening for state changes of master switch "
                      "(entity_id={})."
                      .format(repr(master)),
                      level="DEBUG")
-            self.listen_state(self._master_switch_cb, master)
+            self.listen_state(self.work_queue.wrap(self._master_switch_cb),
+                              master)
 
         if self.master_is_on():
-            for room in self.rooms:
-                if not room.check_for_open_window():
-                    room.apply_schedule(
-                        send=self.cfg["reschedule_at_startup"]
-                    )
+            rooms = [room for room in self.rooms
+                     if not room.check_for_open_window()]
+            self.apply_schedules(
+                rooms=rooms, send=self.cfg["reschedule_at_startup"],
+                states=states
+            )
         else:
             self.log("Master switch is off, not setting temperatures "
                      "initially.")
 
+        # diagnostics aren't needed for reaching the temperatures
+        self.log("Checking the configuration for plausibility after "
+                 "startup.",
+                 level="DEBUG")
+        self.run_in(self.work_queue.wrap(self._check_plausibility_cb), 0,
+                    states=states)
+
         for zone in self.stats_zones:
             zone.initialize()
 
+    def terminate(self) -> None:
+        """Is called by AppDaemon when the app is going to be stopped.
+        Shuts down the thread pools used for evaluating schedules and
+        for requests and closes the state store."""
+
+        if self.evaluation_executor is not None:
+            self.evaluation_executor.shutdown(wait=False)
+            self.evaluation_executor = None
+
+        if self.io_executor is not None:
+            self.io_executor.shutdown(wait=False)
+            self.io_executor = None
+
+        if self.state_store is not None:
+            self.state_store.close()
+            self.state_store = None
+
+    def _check_plausibility_cb(self, kwargs: dict) -> None:
+        """Checks the configuration of all thermostats against their
+        states given as kwargs["states"] and logs a single report of
+        all possible problems found."""
+
+        states = kwargs["states"]
+        report = []  # type: T.List[str]
+        for room in self.rooms:
+            for therm in room.thermostats:
+                problems = therm.check_config_plausibility(
+                    states.get(therm.entity_id)
+                )
+                report.extend("[{}] [{}] {}".format(room, therm, problem)
+                              for problem in problems)
+
+        if not report:
+            self.log("Configuration plausibility check found no problems.",
+                     level="DEBUG")
+            return
+        self.log("Configuration plausibility check found {} possible "
+                 "problem(s):\n{}"
+                 .format(len(report), "\n".join(report)),
+                 level="WARNING")
+
+    def _clear_event_queue(self) -> None:
+        """Drops all queued events and cancels the timer for processing
+        them."""
+
+        self._queued_reschedules.clear()
+        self._queued_set_temps.clear()
+        if self._event_queue_timer is not None:
+            self.cancel_timer(self._event_queue_timer)
+            self._event_queue_timer = None
+
+    def _dump_trace_event_cb(
+            self, event: str, data: dict, kwargs: dict
+    ) -> None:
+        """This callback executes when a heaty_dump_trace event is
+        received. It logs the recent schedule evaluations of the room
+        given as "room_name" in data or of all rooms."""
+
+        if data.get("heaty_id", self.cfg["heaty_id"]) != self.cfg["heaty_id"]:
+            self.log("Ignoring dump_trace event for heaty_id '{}', "
+                     "ours is '{}'."
+                     .format(data.get("heaty_id"), self.cfg["heaty_id"]),
+                     level="DEBUG")
+            return
+
+        room_name = data.get("room_name")
+        if room_name is None:
+            rooms = self.rooms
+        else:
+            room = self.get_room(room_name)
+            if room is None:
+                self.log("Ignoring dump_trace event for unknown "
+                         "room {}.".format(room_name),
+                         level="WARNING")
+                return
+            rooms = [room]
+
+        for room in rooms:
+            room.dump_evaluation_trace()
+
+    def _event_queue_timer_cb(self, kwargs: dict) -> None:
+        """Processes all queued heaty_reschedule and heaty_set_temp events.
+        Temperatures are set first. The rooms to re-schedule are then
+        handled together in a single scheduling pass."""
+
+        self._event_queue_timer = None
+        reschedules = self._queued_reschedules
+        set_temps = self._queued_set_temps
+        self._queued_reschedules = {}
+        self._queued_set_temps = {}
+
+        self.log("Processing queued events for {} room(s) "
+                 "({} queued, {} merged in total)."
+                 .format(len(set(reschedules) | set(set_temps)),
+                         self.event_queue_stats["queued"],
+                         self.event_queue_stats["merged"]),
+                 level="DEBUG")
+
+        with self.service_batcher.collect():
+            rooms = []
+            for room in self.rooms:
+                if room in set_temps:
+                    room.work_queue.submit(
+                        room.notify_set_temp_event, **set_temps[room]
+                    )
+                if room not in reschedules:
+                    continue
+                # the re-schedule timer is checked in the room's work
+                # queue, as it may be cancelled by jobs queued before
+                room.work_queue.submit(self._reset_room, room,
+                                       keep_timer=not reschedules[room])
+                rooms.append(room)
+
+            if rooms:
+                self.apply_schedules(rooms=rooms)
+
     def _master_switch_cb(
             self, entity: str, attr: str, old: T.Any, new: T.Any, kwargs: dict
     ) -> None:
@@ -110,14 +338,134 @@ class HeatyApp(common.App):
 
         self.log("Master switch turned {}.".format(new),
                  prefix=common.LOG_PREFIX_INCOMING)
-        for room in self.rooms:
-            if new == "on":
-                room.apply_schedule()
+        self._master_is_on = new == "on"
+        if self._master_is_on:
+            self.apply_schedules()
+            return
+
+        self._clear_event_queue()
+        # thermostats of all rooms share service calls, which are sent
+        # in parallel if io_threads is configured
+        with self.service_batcher.collect():
+            for room in self.rooms:
+                room.work_queue.submit(self._reset_room, room,
+                                       temp=self.cfg["master_off_temp"])
+
+    def _parse_set_temp(
+            self, data: dict, multiple: bool = False
+    ) -> T.Tuple[T.List["Room"], T.Dict[str, T.Any]]:
+        """Validates the data of a heaty_set_temp event and returns the
+        room to set the temperature in as a single-element list,
+        together with the keyword arguments for
+        Room.notify_set_temp_event().
+        With multiple=True, as used for the entries of heaty_set_temps,
+        "room_name" may also be a glob pattern or a list of names and
+        patterns and all matching rooms are returned.
+        Numeric values are taken as plain temperatures, everything else
+        has to be a temperature expression string.
+        ValueError is raised with a description of the problem if the
+        data is invalid."""
+
+        try:
+            room_names = data["room_name"]
+            for key in ("value", "v", "temp"):
+                if key in data:
+                    temp_expr = data[key]
+                    break
             else:
-                room.cancel_reschedule_timer()
-                room.set_temp(self.cfg["master_off_temp"], scheduled=False)
-                # invalidate cached temp
-                room.scheduled_temp = None
+                raise KeyError(key)
+            if isinstance(temp_expr, (float, int)) and \
+               not isinstance(temp_expr, bool):
+                # plain numbers, e.g. from JSON, are no expressions
+                temp_expr = expr.Temp(temp_expr)
+            elif not isinstance(temp_expr, str):
+                raise TypeError()
+            reschedule_delay = data.get("reschedule_delay")
+            if not isinstance(reschedule_delay, (type(None), float, int)):
+                raise TypeError()
+            if isinstance(reschedule_delay, (float, int)) and \
+               reschedule_delay < 0:
+                raise ValueError()
+            if not multiple or not isinstance(room_names, list):
+                room_names = [room_names]
+            if not room_names or \
+               not all(isinstance(name, str) for name in room_names):
+                raise TypeError()
+        except (KeyError, TypeError, ValueError) as err:
+            raise ValueError(
+                "with invalid data: {}".format(repr(data))
+            ) from err
+
+        rooms = set()  # type: T.Set[Room]
+        for room_name in room_names:
+            room = self.get_room(room_name)
+            if room is not None:
+                rooms.add(room)
+                continue
+            matches = fnmatch.filter(self._rooms_by_name, room_name) \
+                      if multiple else []
+            if not matches:
+                raise ValueError("for unknown room {}".format(room_name))
+            rooms.update(self._rooms_by_name[name] for name in matches)
+
+        if not self.cfg["untrusted_temp_expressions"] and \
+           expr.Temp.parse_temp(temp_expr) is None:
+            raise ValueError("with an untrusted temperature expression "
+                             "(untrusted_temp_expressions = false)")
+
+        return [room for room in self.rooms if room in rooms], {
+            "temp_expr": temp_expr,
+            "force_resend": bool(data.get("force_resend")),
+            "reschedule_delay": reschedule_delay,
+        }
+
+    def _parse_set_temps(
+            self, data: dict
+    ) -> T.List[T.Tuple[T.List["Room"], T.Dict[str, T.Any]]]:
+        """Validates the data of a heaty_set_temps event or API request.
+        data must contain a non-empty list "temps", whose entries are
+        validated by _parse_set_temp(..., multiple=True). The results
+        are returned in the same order.
+        ValueError is raised with a description of the problem if any
+        of the entries is invalid."""
+
+        entries = data.get("temps") if isinstance(data, dict) else None
+        if not isinstance(entries, list) or not entries or \
+           not all(isinstance(entry, dict) for entry in entries):
+            raise ValueError("with invalid data: {}".format(repr(data)))
+        return [self._parse_set_temp(entry, multiple=True)
+                for entry in entries]
+
+    def _process_set_temps(
+            self, set_temps: T.List[T.Tuple[T.List["Room"], T.Dict[str, T.Any]]]
+    ) -> None:
+        """Queues the temperatures returned by _parse_set_temps(), of
+        which later ones win for rooms matched multiple times, and
+        processes the event queue right away.
+        This is meant to be run through the app's work queue."""
+
+        for rooms, kwargs in set_temps:
+            for room in rooms:
+                self._queue_set_temp(room, kwargs)
+
+        # the request is a batch on its own, no need to wait for more
+        if self._event_queue_timer is not None:
+            self.cancel_timer(self._event_queue_timer)
+        self._event_queue_timer_cb({})
+
+    def _queue_set_temp(self, room: "Room", kwargs: T.Dict[str, T.Any]) -> None:
+        """Queues setting a temperature in the given room. kwargs are
+        passed to Room.notify_set_temp_event() when the queue is
+        processed."""
+
+        # the latest temperature wins, it also supersedes a re-scheduling
+        # requested before
+        self.event_queue_stats["queued"] += 1
+        if room in self._queued_set_temps:
+            self.event_queue_stats["merged"] += 1
+        if self._queued_reschedules.pop(room, None) is not None:
+            self.event_queue_stats["merged"] += 1
+        self._queued_set_temps[room] = kwargs
 
     def _reschedule_event_cb(
             self, event: str, data: dict, kwargs: dict
@@ -155,9 +503,34 @@ class HeatyApp(common.App):
             return
 
         for room in rooms:
-            # delay for 6 seconds to avoid re-scheduling multiple
-            # times if multiple events come in shortly
-            room.start_reschedule_timer(reschedule_delay=0.1, restart=restart)
+            self.event_queue_stats["queued"] += 1
+            if room in self._queued_reschedules:
+                self.event_queue_stats["merged"] += 1
+            self._queued_reschedules[room] = \
+                restart or self._queued_reschedules.get(room, False)
+        self._start_event_queue_timer()
+
+    @staticmethod
+    def _reset_room(
+            room: "Room", temp: T.Optional[expr.Temp] = None,
+            keep_timer: bool = False
+    ) -> None:
+        """Cancels the room's re-schedule timer and invalidates its
+        scheduled temperature, so that the schedule is applied again.
+        If given, temp is set in the room in between.
+        With keep_timer=True, a running re-schedule timer is left alone
+        and the room isn't reset at all.
+        This is meant to be run through the room's work queue."""
+
+        if keep_timer and room.reschedule_timer is not None:
+            room.log("Re-schedule timer running already, waiting for it.",
+                     level="DEBUG")
+            return
+        room.cancel_reschedule_timer()
+        if temp is not None:
+            room.set_temp(temp, scheduled=False)
+        # invalidate cached temp
+        room.scheduled_temp = None
 
     def _set_temp_event_cb(
             self, event: str, data: dict, kwargs: dict
@@ -177,71 +550,171 @@ class HeatyApp(common.App):
             return
 
         try:
-            room_name = data["room_name"]
-            for key in ("v", "temp"):
-                if key in data:
-                    data.setdefault("value", data[key])
-                    break
-            temp_expr = data["value"]
-            reschedule_delay = data.get("reschedule_delay")
-            if not isinstance(reschedule_delay, (type(None), float, int)):
-                raise TypeError()
-            if isinstance(reschedule_delay, (float, int)) and \
-               reschedule_delay < 0:
-                raise ValueError()
-        except (KeyError, TypeError, ValueError):
-            self.log("Ignoring heaty_set_temp event with invalid data: {}"
-                     .format(repr(data)),
+            rooms, set_temp_kwargs = self._parse_set_temp(data)
+        except ValueError as err:
+            self.log("Ignoring heaty_set_temp event {}.".format(err),
                      level="WARNING")
             return
 
-        room = self.get_room(room_name)
-        if not room:
-            self.log("Ignoring heaty_set_temp event for unknown "
-                     "room {}.".format(room_name),
+        self._queue_set_temp(rooms[0], set_temp_kwargs)
+        self._start_event_queue_timer()
+
+    def _set_temps_endpoint_cb(
+            self, data: dict
+    ) -> T.Tuple[T.Dict[str, T.Any], int]:
+        """This callback executes when the heaty_<heaty_id>_set_temps
+        API endpoint is requested. data has the same format as for the
+        heaty_set_temps event. The names of the affected rooms are
+        returned, or an error message with status 400 if data is
+        invalid."""
+
+        self.log("API request to set temperatures received.",
+                 prefix=common.LOG_PREFIX_INCOMING)
+
+        try:
+            set_temps = self._parse_set_temps(data)
+        except ValueError as err:
+            self.log("Ignoring heaty_set_temps request {}.".format(err),
                      level="WARNING")
+            return {"error": "Request {}.".format(err)}, 400
+
+        self.work_queue.submit(self._process_set_temps, set_temps)
+        room_names = {room.name for rooms, _ in set_temps for room in rooms}
+        return {"rooms": sorted(room_names)}, 200
+
+    def _set_temps_event_cb(
+            self, event: str, data: dict, kwargs: dict
+    ) -> None:
+        """This callback executes when a heaty_set_temps event is
+        received. data must contain a list "temps" of entries like the
+        data of heaty_set_temp events, but "room_name" may also be a
+        glob pattern or a list of names and patterns. All temperatures
+        are set together. If any entry is invalid, the whole event is
+        ignored."""
+
+        if data.get("heaty_id", self.cfg["heaty_id"]) != self.cfg["heaty_id"]:
+            self.log("Ignoring set_temps event for heaty_id '{}', "
+                     "ours is '{}'."
+                     .format(data.get("heaty_id"), self.cfg["heaty_id"]),
+                     level="DEBUG")
             return
 
-        if not self.cfg["untrusted_temp_expressions"] and \
-           expr.Temp.parse_temp(temp_expr) is None:
-            self.log("Ignoring heaty_set_temp event with an "
-                     "untrusted temperature expression. "
-                     "(untrusted_temp_expressions = false)",
+        try:
+            set_temps = self._parse_set_temps(data)
+        except ValueError as err:
+            self.log("Ignoring heaty_set_temps event {}.".format(err),
                      level="WARNING")
             return
 
-        room.notify_set_temp_event(
-            temp_expr, force_resend=bool(data.get("force_resend")),
-            reschedule_delay=reschedule_delay
-        )
+        self._process_set_temps(set_temps)
+
+    def _start_event_queue_timer(self) -> None:
+        """Starts the timer for processing the queued events, unless
+        it's running already. With a window of 0 seconds, the queue is
+        processed immediately."""
+
+        window = self.cfg["event_coalescing_window"]
+        if not window:
+            self._event_queue_timer_cb({})
+            return
+        if self._event_queue_timer is None:
+            self.log("Processing queued events in {} seconds."
+                     .format(window),
+                     level="DEBUG")
+            self._event_queue_timer = self.run_in(
+                self.work_queue.wrap(self._event_queue_timer_cb), window
+            )
+
+    def _status_endpoint_cb(
+            self, data: dict
+    ) -> T.Tuple[T.Dict[str, T.Any], int]:
+        """This callback executes when the heaty_<heaty_id>_status API
+        endpoint is requested. It returns the result of get_status()."""
+
+        self.log("API request for status received.",
+                 level="DEBUG", prefix=common.LOG_PREFIX_INCOMING)
+        return self.get_status(), 200
+
+    def apply_schedules(
+            self, rooms: T.Optional[T.Iterable["Room"]] = None,
+            send: bool = True, force_resend: bool = False,
+            states: T.Optional[T.Dict[str, T.Any]] = None
+    ) -> None:
+        """Applies the schedules of the given rooms (all rooms by default)
+        in a single scheduling pass. All rooms are evaluated first,
+        sharing one clock reading, state snapshot and cache for
+        temperature expression results, before the results are applied.
+        See Room.apply_schedule() for the meaning of send and
+        force_resend. states may be a dictionary of all entity states,
+        as returned by get_state() without arguments, which is used
+        instead of asking AppDaemon. If the master switch is turned
+        off, this won't do anything."""
+
+        if not self.require_master_is_on():
+            return
+
+        if rooms is None:
+            rooms = self.rooms
+        sched_pass = scheduling.SchedulingPass(self, rooms, states=states)
+        sched_pass.run(send=send, force_resend=force_resend)
+
+    def gather(self, calls: T.Iterable[T.Callable[[], T.Any]]) -> T.List[T.Any]:
+        """Executes the given calls, which must be independent of each
+        other, and returns their results in the same order once all of
+        them have finished. If io_threads is configured, the calls run
+        concurrently, so that requests to Home Assistant they make don't
+        have to wait for each other."""
+
+        calls = list(calls)
+        executor = self.io_executor
+        if executor is None or len(calls) < 2:
+            return [call() for call in calls]
+        futures = [executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
 
     def get_room(self, room_name: str) -> T.Optional["Room"]:
         """Returns the room with given name or None, if no such room
         exists."""
 
-        for room in self.rooms:
-            if room.name == room_name:
-                return room
-        return None
+        return self._rooms_by_name.get(room_name)
+
+    def get_status(self) -> T.Dict[str, T.Any]:
+        """Returns a JSON-serializable snapshot of the state of all
+        rooms, as tracked in memory."""
+
+        return {
+            "heaty_id": self.cfg["heaty_id"],
+            "master_is_on": self.master_is_on(),
+            "rooms": {room.name: room.get_status() for room in self.rooms},
+        }
 
     def master_is_on(self) -> bool:
         """Returns whether the master switch is "on". If no master switch
-        is configured, this returns True."""
+        is configured, this returns True.
+        The state is tracked locally by listening for state changes of
+        the master switch, hence no request to AppDaemon is made."""
 
-        master = self.cfg["master_switch"]
-        if master:
-            return self.get_state(master) == "on"  # type: ignore
-        return True
+        return self._master_is_on
 
     def require_master_is_on(self) -> bool:
         """Returns whether the master switch is on. If not, a debug
         message is logged."""
 
-        if not self.master_is_on():
-            stack = inspect.stack()
-            caller_name = stack[1].function
-            self.log("Master switch is off, aborting {}."
-                     .format(repr(caller_name)),
+        if not self._master_is_on:
+            self.log("Master switch is off, aborting.",
                      level="DEBUG")
             return False
         return True
+
+    def store_state(self, key: str, value: T.Any) -> None:
+        """Writes the given JSON-serializable value to the state store,
+        if one is configured. A value of None removes the key."""
+
+        if self.state_store is None:
+            return
+        try:
+            self.state_store.set(key, value)
+        except store.StoreError as err:
+            self.log("Error while writing to the state store: {}"
+                     .format(err),
+                     level="ERROR")
@@ -0,0 +1,162 @@
+"""
+This module implements the ServiceCallBatcher class, which combines
+service calls sent to multiple entities into one.
+"""
+
+import typing as T
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    import uuid
+    from .app import HeatyApp
+
+import collections
+import contextlib
+import functools
+import threading
+
+
+class _Batch:
+    """The service calls collected for a batch, kept as a sequence of
+    (service, other attributes) per entity."""
+
+    def __init__(self) -> None:
+        self.calls = collections.OrderedDict()  # type: T.Dict[str, T.List[T.Tuple[str, T.Tuple]]]
+
+    def __repr__(self) -> str:
+        return "<_Batch with calls for {} entities>".format(len(self.calls))
+
+    def add(self, service: str, attrs: T.Tuple, entity_id: str) -> None:
+        """Adds a call to the end of the entity's sequence."""
+
+        calls = self.calls.setdefault(entity_id, [])
+        # the latest call to a service wins for every entity
+        calls[:] = [call for call in calls if call[0] != service]
+        calls.append((service, attrs))
+
+    def get_rounds(self) -> T.List[T.List[T.Tuple[str, T.Tuple, T.List[str]]]]:
+        """Returns the calls as a list of rounds to send one after
+        another, each being a list of (service, attrs, entity ids)
+        tuples. Every entity appears at most once per round, so that
+        its calls are sent in the order they were made. The sequences
+        are aligned at their ends, which lets e.g. the temperatures of
+        thermostats that need their operation mode set first and of
+        those that don't share a call."""
+
+        depth = max((len(calls) for calls in self.calls.values()), default=0)
+        rounds = []
+        for index in range(depth):
+            groups = collections.OrderedDict()  # type: T.Dict[T.Tuple[str, T.Tuple], T.List[str]]
+            for entity_id, calls in self.calls.items():
+                offset = index - depth + len(calls)
+                if offset >= 0:
+                    groups.setdefault(calls[offset], []).append(entity_id)
+            rounds.append([(service, attrs, entity_ids)
+                           for (service, attrs), entity_ids in groups.items()])
+        return rounds
+
+
+class ServiceCallBatcher:
+    """Collects outgoing service calls and sends calls which only differ
+    in their entity_id as a single call with a list of entity ids.
+    Calls made by a thread are collected while it's inside a collect()
+    block. Calls made outside of collect() are collected for
+    service_call_batch_window seconds, across all threads. With a
+    window of 0, they're sent directly."""
+
+    def __init__(self, app: "HeatyApp") -> None:
+        self.app = app
+        # the batch of the current thread's collect() block
+        self._local = threading.local()
+        # the batch of calls waiting for the window to end
+        self._window_batch = _Batch()
+        self._timer = None  # type: T.Optional[uuid.UUID]
+        # AppDaemon runs callbacks in multiple threads
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "sent": 0}
+
+    def __repr__(self) -> str:
+        return "<ServiceCallBatcher with calls for {} entities pending>" \
+               .format(len(self._window_batch.calls))
+
+    def _flush(self, batch: _Batch) -> None:
+        """Sends all calls of the given batch, round by round. The calls
+        of a round are sent in parallel if io_threads is configured."""
+
+        rounds = batch.get_rounds()
+        count = sum(len(calls) for calls in rounds)
+        if not count:
+            return
+        with self._lock:
+            self.stats["sent"] += count
+
+        self.app.log("Sending {} collected service call(s) in {} round(s) "
+                     "({} sent of {} in total).",
+                     count, len(rounds), self.stats["sent"],
+                     self.stats["calls"],
+                     level="DEBUG")
+        for calls in rounds:
+            # calls of a round address different entities, hence they
+            # may be sent concurrently
+            self.app.gather([
+                functools.partial(self._send, service, attrs, entity_ids)
+                for service, attrs, entity_ids in calls
+            ])
+
+    def _send(
+            self, service: str, attrs: T.Tuple, entity_ids: T.List[str]
+    ) -> None:
+        """Sends a single service call for the given entity ids."""
+
+        _attrs = dict(attrs)
+        _attrs["entity_id"] = entity_ids[0] if len(entity_ids) == 1 \
+                              else entity_ids
+        self.app.call_service(service, **_attrs)
+
+    def _timer_cb(self, kwargs: dict) -> None:
+        """Sends the calls collected during the window."""
+
+        with self._lock:
+            self._timer = None
+            batch = self._window_batch
+            self._window_batch = _Batch()
+        self._flush(batch)
+
+    def call_service(self, service: str, **attrs: T.Any) -> None:
+        """Queues a call of the given service for attrs["entity_id"].
+        If calls aren't collected at the moment, it's sent directly."""
+
+        entity_id = attrs.pop("entity_id")
+        attrs_key = tuple(sorted(attrs.items()))
+        batch = getattr(self._local, "batch", None)
+        window = self.app.cfg["service_call_batch_window"]
+        with self._lock:
+            self.stats["calls"] += 1
+            if batch is None and window:
+                self._window_batch.add(service, attrs_key, entity_id)
+                if self._timer is None:
+                    self._timer = self.app.run_in(self._timer_cb, window)
+                return
+            if batch is None:
+                self.stats["sent"] += 1
+        if batch is not None:
+            batch.add(service, attrs_key, entity_id)
+            return
+        self._send(service, attrs_key, [entity_id])
+
+    @contextlib.contextmanager
+    def collect(self) -> T.Iterator[None]:
+        """A context manager during which the service calls made by the
+        current thread are collected. They're sent once the outermost
+        block has been left. Nesting is allowed."""
+
+        if getattr(self._local, "batch", None) is not None:
+            yield
+            return
+
+        batch = _Batch()
+        self._local.batch = batch
+        try:
+            yield
+        finally:
+            self._local.batch = None
+            self._flush(batch)
@@ -48,8 +48,14 @@ def config_post_hook(cfg: dict) -> dict:
     # pylint: disable=too-many-locals
 
     # name schedule snippets
+    snippets_use_room_name = False
     for name, sched in cfg["schedule_snippets"].items():
         sched.name = name
+        if "room_name" in sched.get_referenced_names():
+            snippets_use_room_name = True
+
+    # rules by signature for hash-consing
+    rules = {}  # type: T.Dict[T.Tuple, schedule.Rule]
 
     # Build room objects.
     rooms = []
@@ -73,6 +79,10 @@ def config_post_hook(cfg: dict) -> dict:
         sched = cfg["schedule_prepend"] + room_data["schedule"] + \
                 cfg["schedule_append"]
         sched.name = room_name
+        # Identical rules are replaced by a single object, hence rooms
+        # with identical schedules end up with the same rules.
+        sched.rules = [rules.setdefault(rule.signature, rule)
+                       for rule in sched.rules]
 
         del room_data["thermostats"]
         del room_data["window_sensors"]
@@ -90,6 +100,12 @@ def config_post_hook(cfg: dict) -> dict:
             room.window_sensors.append(wsensor)
 
         room.schedule = sched
+        # Rooms with the same key get the same evaluation result, unless
+        # the result depends on the room's name.
+        names = sched.get_referenced_names()
+        if "room_name" not in names and \
+           not (snippets_use_room_name and "IncludeSchedule" in names):
+            room.schedule_key = tuple(sched.rules)
     del cfg["rooms"], cfg["schedule_prepend"], cfg["schedule_append"]
     cfg["_app"].rooms = rooms
 
@@ -190,10 +206,20 @@ THERMOSTAT_SCHEMA = vol.Schema(vol.All(
             None,
         ),
         vol.Optional("off_temp", default=expr.OFF): TEMP_SCHEMA,
+        vol.Optional("temp_step", default=None): vol.Any(
+            vol.All(vol.Any(float, int), vol.Range(min=0, min_included=False)),
+            None,
+        ),
+        vol.Optional("temp_deadband", default=0):
+            vol.All(vol.Any(float, int), vol.Range(min=0)),
         vol.Optional("set_temp_retries", default=10):
             vol.All(int, vol.Range(min=-1)),
         vol.Optional("set_temp_retry_interval", default=30):
             vol.All(int, vol.Range(min=1)),
+        vol.Optional("set_temp_retry_backoff", default=1.5):
+            vol.All(vol.Any(float, int), vol.Range(min=1)),
+        vol.Optional("set_temp_retry_max_interval", default=300):
+            vol.All(int, vol.Range(min=1)),
         vol.Optional("supports_opmodes", default=True): bool,
         vol.Optional("supports_temps", default=True): bool,
         vol.Optional("opmode_heat", default="heat"): str,
@@ -213,6 +239,8 @@ THERMOSTAT_SCHEMA = vol.Schema(vol.All(
             "target_temp_service", default="climate/set_temperature"
         ): str,
         vol.Optional("target_temp_service_attr", default="temperature"): str,
+        vol.Optional("target_temp_service_opmode_attr", default=None):
+            vol.Any(str, None),
         vol.Optional("target_temp_state_attr", default="temperature"): str,
         vol.Optional(
             "current_temp_state_attr", default="current_temperature"
@@ -281,6 +309,8 @@ ROOM_SCHEMA = vol.Schema(vol.All(
     {
         "friendly_name": str,
         vol.Optional("replicate_changes", default=True): bool,
+        vol.Optional("replicate_settle_time", default=2):
+            vol.All(vol.Any(float, int), vol.Range(min=0)),
         vol.Optional("reschedule_delay", default=0):
             vol.All(int, vol.Range(min=0)),
         vol.Optional("thermostats", default=dict): DICTS_IN_DICT_SCHEMA,
@@ -354,6 +384,17 @@ CONFIG_SCHEMA = vol.Schema(vol.All(
         vol.Optional("window_open_temp", default=expr.OFF): TEMP_SCHEMA,
         vol.Optional("reschedule_at_startup", default=True): bool,
         vol.Optional("untrusted_temp_expressions", default=False): bool,
+        vol.Optional("evaluation_threads", default=1):
+            vol.All(int, vol.Range(min=1)),
+        vol.Optional("evaluation_trace_size", default=10):
+            vol.All(int, vol.Range(min=0)),
+        vol.Optional("event_coalescing_window", default=1):
+            vol.All(vol.Any(float, int), vol.Range(min=0)),
+        vol.Optional("io_threads", default=1):
+            vol.All(int, vol.Range(min=1)),
+        vol.Optional("service_call_batch_window", default=0):
+            vol.All(vol.Any(float, int), vol.Range(min=0)),
+        vol.Optional("state_store", default=None): vol.Any(str, None),
         vol.Optional("temp_expression_modules", default=dict):
             TEMP_EXPRESSION_MODULES_SCHEMA,
         vol.Optional("thermostat_defaults", default=dict):
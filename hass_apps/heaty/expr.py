@@ -221,14 +221,22 @@ class Temp:
         return str(self.value)
 
 
-def build_expr_env(app: "HeatyApp") -> T.Dict[str, T.Any]:
+def build_expr_env(
+        app: "HeatyApp", now: T.Optional[datetime.datetime] = None,
+        get_state: T.Optional[T.Callable[..., T.Any]] = None
+) -> T.Dict[str, T.Any]:
     """This function builds and returns an environment usable as globals
     for the evaluation of an expression. It will add all members
     of this module's __all__ to the environment. Additionally, some
-    helpers will be constructed based on the HeatyApp object"""
+    helpers will be constructed based on the HeatyApp object.
+    now and get_state may be given to use a fixed point in time and
+    a custom state getter instead of asking AppDaemon."""
 
     # use date/time provided by appdaemon to support time-traveling
-    now = app.datetime()
+    if now is None:
+        now = app.datetime()
+    if get_state is None:
+        get_state = app.get_state
     env = {
         "app": app,
         "schedule_snippets": app.cfg["schedule_snippets"],
@@ -236,12 +244,8 @@ def build_expr_env(app: "HeatyApp") -> T.Dict[str, T.Any]:
         "now": now,
         "date": now.date(),
         "time": now.time(),
-        "state": app.get_state,
-        "is_on":
-            lambda entity_id: str(app.get_state(entity_id)).lower() == "on",
-        "is_off":
-            lambda entity_id: str(app.get_state(entity_id)).lower() == "off",
     }
+    env.update(build_state_env(get_state))
 
     globs = globals()
     for name in __all__:
@@ -251,14 +255,30 @@ def build_expr_env(app: "HeatyApp") -> T.Dict[str, T.Any]:
 
     return env
 
+def build_state_env(get_state: T.Callable[..., T.Any]) -> T.Dict[str, T.Any]:
+    """Builds the helpers for querying entity states (state, is_on and
+    is_off) around the given state getter and returns them as a
+    dictionary to be added to an evaluation environment."""
+
+    return {
+        "state": get_state,
+        "is_on":
+            lambda entity_id: str(get_state(entity_id)).lower() == "on",
+        "is_off":
+            lambda entity_id: str(get_state(entity_id)).lower() == "off",
+    }
+
 def eval_temp_expr(
         temp_expr: ExprType,
         app: "HeatyApp",
-        extra_env: T.Optional[T.Dict[str, T.Any]] = None
+        extra_env: T.Optional[T.Dict[str, T.Any]] = None,
+        env: T.Optional[T.Dict[str, T.Any]] = None
 ) -> T.Optional[ResultBase]:
     """This method evaluates the given temperature expression.
     The evaluation result is returned. The items of the extra_env
     dict are added to the globals available during evaluation.
+    A pre-built environment may be passed as env, it is copied
+    before extra_env is applied. Otherwise, a new one is built.
     If the expression is a Temp object already, it's just packed into
     a Result and returned directly."""
 
@@ -267,7 +287,10 @@ def eval_temp_expr(
     if isinstance(temp_expr, Temp):
         return Result(temp_expr)
 
-    env = build_expr_env(app)
+    if env is None:
+        env = build_expr_env(app)
+    else:
+        env = env.copy()
     if extra_env:
         env.update(extra_env)
 
@@ -275,3 +298,17 @@ def eval_temp_expr(
     if eval_result is None or isinstance(eval_result, ResultBase):
         return eval_result
     return Result(eval_result)
+
+def get_referenced_names(temp_expr: ExprType) -> T.FrozenSet[str]:
+    """Returns the global names referenced by the given temperature
+    expression, including those used in nested code like lambdas
+    or comprehensions. Temp objects reference no names at all."""
+
+    if not isinstance(temp_expr, types.CodeType):
+        return frozenset()
+
+    names = set(temp_expr.co_names)
+    for const in temp_expr.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(get_referenced_names(const))
+    return frozenset(names)
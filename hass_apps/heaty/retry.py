@@ -0,0 +1,109 @@
+"""
+This module implements the RetryScheduler class, which re-sends
+temperatures to thermostats until they confirm them.
+"""
+
+import typing as T
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    import uuid
+    from .app import HeatyApp
+    from .thermostat import Thermostat
+
+import datetime
+import heapq
+import itertools
+import random
+import threading
+
+
+# re-sends due within this time after the earliest one are sent with it
+RETRY_BATCH_SLACK = datetime.timedelta(seconds=2)
+# delays are randomly varied by this fraction to spread re-sends
+RETRY_JITTER = 0.1
+
+
+class RetryScheduler:
+    """Keeps the re-sends due for all thermostats in a priority queue,
+    with a single AppDaemon timer for the earliest one. Re-sends that
+    come due together are sent as a batch."""
+
+    def __init__(self, app: "HeatyApp") -> None:
+        self.app = app
+        # heap of (when, sequence number, thermostat), entries whose time
+        # doesn't match the thermostat's resend_at anymore are outdated
+        self._queue = []  # type: T.List[T.Tuple[datetime.datetime, int, Thermostat]]
+        self._seq = itertools.count()
+        self._timer = None  # type: T.Optional[uuid.UUID]
+        self._timer_at = None  # type: T.Optional[datetime.datetime]
+        # AppDaemon runs callbacks in multiple threads
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return "<RetryScheduler with {} queued re-sends>".format(
+            len(self._queue)
+        )
+
+    def _start_timer(self) -> None:
+        """Starts the timer for the earliest re-send, unless one runs for
+        an earlier time already. The lock must be held."""
+
+        if not self._queue:
+            return
+        when = self._queue[0][0]
+        if self._timer is not None:
+            assert self._timer_at is not None
+            if self._timer_at <= when:
+                return
+            self.app.cancel_timer(self._timer)
+        self._timer = self.app.run_at(self._timer_cb, when)
+        self._timer_at = when
+
+    def _timer_cb(self, kwargs: dict) -> None:
+        """Sends all re-sends that are due."""
+
+        limit = self.app.datetime() + RETRY_BATCH_SLACK
+        due = []
+        seen = set()  # type: T.Set[Thermostat]
+        with self._lock:
+            self._timer = None
+            self._timer_at = None
+            while self._queue and self._queue[0][0] <= limit:
+                when, _, therm = heapq.heappop(self._queue)
+                if therm.resend_at == when and therm not in seen:
+                    seen.add(therm)
+                    due.append((therm, when))
+            self._start_timer()
+
+        if not due:
+            return
+
+        self.app.log("Re-sending to {} thermostat(s), {} more queued.",
+                     len(due), len(self._queue),
+                     level="DEBUG")
+        with self.app.service_batcher.collect():
+            for therm, when in due:
+                therm.room.work_queue.submit(therm.resend, when)
+
+    def schedule(self, therm: "Thermostat", when: datetime.datetime) -> None:
+        """Queues a re-send for the given thermostat. It's only sent if
+        therm.resend_at still equals when at that time."""
+
+        with self._lock:
+            heapq.heappush(self._queue, (when, next(self._seq), therm))
+            self._start_timer()
+
+
+def get_retry_delay(
+        interval: T.Union[float, int], backoff: T.Union[float, int],
+        max_interval: T.Union[float, int], attempt: int
+) -> float:
+    """Returns the number of seconds to wait before the given retry
+    (0 for the first), growing exponentially from interval by the
+    factor backoff, but not beyond max_interval. The delay is varied
+    randomly by RETRY_JITTER."""
+
+    # the exponent is limited to not overflow with unlimited retries
+    delay = min(interval * backoff ** min(attempt, 64),
+                max(interval, max_interval))
+    return delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
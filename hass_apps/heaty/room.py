@@ -9,13 +9,14 @@ if T.TYPE_CHECKING:
     from .app import HeatyApp
     from .thermostat import Thermostat
 
+import collections
 import datetime
+import time
 
 from .. import common
-from . import expr, schedule, util
+from . import expr, schedule, scheduling, util, workqueue
 from .window_sensor import WindowSensor
 
-
 class Room:
     """A room to be controlled by Heaty."""
 
@@ -28,10 +29,33 @@ class Room:
         self.thermostats = []  # type: T.List[Thermostat]
         self.window_sensors = []  # type: T.List[WindowSensor]
         self.schedule = None  # type: T.Optional[schedule.Schedule]
-
-        self.wanted_temp = None  # type: T.Optional[expr.Temp]
-        self.scheduled_temp = None  # type: T.Optional[expr.Temp]
+        # all callbacks for this room and its thermostats and window
+        # sensors are serialized through this queue
+        self.work_queue = workqueue.WorkQueue(self.log)
+        # rooms with an equal schedule_key share evaluation results,
+        # None if the result is specific to this room
+        self.schedule_key = None  # type: T.Optional[T.Tuple[schedule.Rule, ...]]
+
+        self._wanted_temp = None  # type: T.Optional[expr.Temp]
+        self._scheduled_temp = None  # type: T.Optional[expr.Temp]
         self.reschedule_timer = None  # type: T.Optional[uuid.UUID]
+        self.reschedule_at = None  # type: T.Optional[datetime.datetime]
+        # manual change waiting for the thermostats to settle
+        self._settle_timer = None  # type: T.Optional[uuid.UUID]
+        self._settle_temp = None  # type: T.Optional[expr.Temp]
+        # number of window sensors reporting to be open
+        self.open_window_count = 0
+        # inputs and result of the last schedule evaluation
+        self.last_evaluation = None  # type: T.Optional[scheduling.EvaluationRecord]
+        # attributes last published with the scheduled_temp sensor
+        self._scheduled_temp_attrs = None  # type: T.Optional[T.Dict[str, T.Any]]
+        # (time, record) tuples of recent evaluations, records are
+        # reused for evaluations that have been skipped; the size is
+        # set upon initialization
+        self.evaluation_trace = collections.deque(
+            maxlen=0
+        )  # type: T.Deque[T.Tuple[datetime.datetime, scheduling.EvaluationRecord]]
+        self._scheduling_times = frozenset()  # type: T.FrozenSet[datetime.time]
 
     def __repr__(self) -> str:
         return "<Room {}>".format(str(self))
@@ -39,19 +63,79 @@ class Room:
     def __str__(self) -> str:
         return "R:{}".format(self.cfg.get("friendly_name", self.name))
 
-    def _get_sensor(self, param: str) -> T.Any:
-        """Returns the state value of the sensor for given parameter in HA."""
+    @property
+    def scheduled_temp(self) -> T.Optional[expr.Temp]:
+        """The result of the last schedule evaluation that has been
+        applied. Changes are written to the app's state store."""
+
+        return self._scheduled_temp
+
+    @scheduled_temp.setter
+    def scheduled_temp(self, temp: T.Optional[expr.Temp]) -> None:
+        if temp != self._scheduled_temp:
+            self.app.store_state(
+                self._store_key("scheduled_temp"),
+                temp.serialize() if temp is not None else None
+            )
+        self._scheduled_temp = temp
+
+    @property
+    def wanted_temp(self) -> T.Optional[expr.Temp]:
+        """The temperature the room should have, not taking open windows
+        into account. Changes are written to the app's state store."""
+
+        return self._wanted_temp
+
+    @wanted_temp.setter
+    def wanted_temp(self, temp: T.Optional[expr.Temp]) -> None:
+        if temp != self._wanted_temp:
+            self.app.store_state(
+                self._store_key("wanted_temp"),
+                temp.serialize() if temp is not None else None
+            )
+        self._wanted_temp = temp
+
+    def _get_sensor(self, param: str, states: T.Dict[str, T.Any]) -> T.Any:
+        """Returns the state value of the sensor for given parameter
+        from states, a dictionary as returned by get_state() without
+        arguments."""
 
         entity_id = "sensor.heaty_{}_room_{}_{}" \
                     .format(self.app.cfg["heaty_id"], self.name, param)
-        self.log("Querying state of {}."
-                 .format(repr(entity_id)),
-                 level="DEBUG", prefix=common.LOG_PREFIX_OUTGOING)
-        state = self.app.get_state(entity_id)
-        self.log("= {}".format(repr(state)),
-                 level="DEBUG", prefix=common.LOG_PREFIX_INCOMING)
+        state = (states.get(entity_id) or {}).get("state")
+        self.log("State of {!r} is {!r}.", entity_id, state,
+                 level="DEBUG")
         return state
 
+    def _handle_manual_change(self, neutral_temp: expr.Temp) -> None:
+        """Replicates a temperature set manually at a thermostat (without
+        delta) to the other thermostats, if enabled, and starts or
+        cancels the re-schedule timer."""
+
+        if self.open_window_count or not self.app.master_is_on():
+            return
+
+        if self.cfg["replicate_changes"] and len(self.thermostats) > 1:
+            self.log("Propagating the change to all thermostats "
+                     "in the room.",
+                     prefix=common.LOG_PREFIX_OUTGOING)
+            self.set_temp(neutral_temp, scheduled=False)
+
+        if neutral_temp == self.wanted_temp:
+            self.cancel_reschedule_timer()
+        elif self.cfg["reschedule_delay"]:
+            self.start_reschedule_timer(restart=True)
+
+    def _load_temp(self, param: str) -> T.Optional[expr.Temp]:
+        """Returns the temperature stored for the given parameter in the
+        app's state store or None, if there is none."""
+
+        value = self.app.stored_state.get(self._store_key(param))
+        try:
+            return expr.Temp(value)
+        except ValueError:
+            return None
+
     def _reschedule_timer_cb(self, kwargs: dict) -> None:
         """Is called whenever a re-schedule timer fires."""
 
@@ -59,28 +143,75 @@ class Room:
                  level="DEBUG")
 
         self.reschedule_timer = None
+        self.reschedule_at = None
+        self.app.store_state(self._store_key("reschedule_at"), None)
 
         # invalidate cached temp
         self.scheduled_temp = None
 
         self.apply_schedule()
 
-    def _schedule_timer_cb(self, kwargs: dict) -> None:
-        """Is called whenever a schedule timer fires."""
+    def _restore_stored_state(self) -> None:
+        """Restores the scheduled and wanted temperatures as well as a
+        running re-schedule timer from the app's state store."""
 
-        self.log("Schedule timer fired.",
+        self._scheduled_temp = self._load_temp("scheduled_temp")
+        self._wanted_temp = self._load_temp("wanted_temp")
+        self.log("Restored scheduled temperature {} and wanted "
+                 "temperature {}."
+                 .format(self._scheduled_temp, self._wanted_temp),
                  level="DEBUG")
-        self.apply_schedule()
 
-    def _set_sensor(self, param: str, state: T.Any) -> None:
+        reschedule_at = self.app.stored_state.get(
+            self._store_key("reschedule_at")
+        )
+        if reschedule_at is None:
+            return
+        when = datetime.datetime.strptime(reschedule_at, util.DATETIME_FORMAT)
+        if when <= self.app.datetime():
+            self.log("Re-schedule timer expired while not running.",
+                     level="DEBUG")
+            self.app.store_state(self._store_key("reschedule_at"), None)
+            return
+        self.log("Restoring re-schedule timer for {}.".format(when),
+                 level="DEBUG")
+        self.reschedule_timer = self.app.run_at(
+            self.work_queue.wrap(self._reschedule_timer_cb), when
+        )
+        self.reschedule_at = when
+
+    def _set_sensor(
+            self, param: str, state: T.Any,
+            attributes: T.Optional[T.Dict[str, T.Any]] = None
+    ) -> None:
         """Updates the sensor for given parameter in HA."""
 
         entity_id = "sensor.heaty_{}_room_{}_{}" \
                     .format(self.app.cfg["heaty_id"], self.name, param)
-        self.log("Setting state of {} to {}."
-                 .format(repr(entity_id), repr(state)),
+        self.log("Setting state of {!r} to {!r}.", entity_id, state,
                  level="DEBUG", prefix=common.LOG_PREFIX_OUTGOING)
-        self.app.set_state(entity_id, state=state)
+        if attributes is None:
+            self.app.set_state(entity_id, state=state)
+        else:
+            self.app.set_state(entity_id, state=state, attributes=attributes)
+
+    def _settle_timer_cb(self, kwargs: dict) -> None:
+        """Is called when no further manual changes have been reported
+        during the settle time."""
+
+        self._settle_timer = None
+        temp = self._settle_temp
+        self._settle_temp = None
+        if temp is not None:
+            self.log("Thermostats settled at {}.", temp,
+                     level="DEBUG")
+            self._handle_manual_change(temp)
+
+    def _store_key(self, param: str) -> str:
+        """Returns the key to store the given parameter under in the
+        app's state store."""
+
+        return "room:{}:{}".format(self.name, param)
 
     def apply_schedule(
             self, send: bool = True, force_resend: bool = False
@@ -95,42 +226,55 @@ class Room:
         actually setting the thermostats.
         If force_resend is True and the temperature didn't change,
         it is sent to the thermostats anyway.
-        In case of an open window, temperature is cached and not sent."""
-
-        if not self.app.require_master_is_on():
-            return
-
-        if self.reschedule_timer:
-            # don't schedule now, wait for the timer instead
-            self.log("Not scheduling now due to a running re-schedule "
-                     "timer.",
-                     level="DEBUG")
-            return
+        In case of an open window, temperature is cached and not sent.
+        This is a shortcut for a scheduling pass containing just this
+        room."""
 
-        self.log("Applying room's schedule.",
-                 level="DEBUG")
+        self.app.apply_schedules(
+            rooms=[self], send=send, force_resend=force_resend
+        )
 
-        result = self.get_scheduled_temp()
-        if result is None:
+    def apply_scheduled_temp(
+            self, record: T.Optional[scheduling.EvaluationRecord],
+            send: bool = True, force_resend: bool = False
+    ) -> None:
+        """Applies the result of a schedule evaluation, as kept in
+        self.last_evaluation. See apply_schedule() for the meaning of
+        send and force_resend.
+        The scheduled_temp sensor is updated along with the temperature.
+        Its attributes tell the rule the temperature came from and the
+        time the result might change next."""
+
+        temp = record.temp if record is not None else None
+        if temp is None:
             self.log("No suitable temperature found in schedule.",
                      level="DEBUG")
             return
 
-        temp = result[0]
+        assert record is not None
+        attrs = {
+            "rule": repr(record.path or record.rule),
+            "next_change": record.valid_until.strftime(util.DATETIME_FORMAT)
+                           if record.valid_until is not None else None,
+        }
         if temp == self.scheduled_temp and not force_resend:
+            if attrs != self._scheduled_temp_attrs:
+                self._scheduled_temp_attrs = attrs
+                self._set_sensor("scheduled_temp", temp.serialize(), attrs)
             self.log("Result didn't change, not setting it again.",
                      level="DEBUG")
             return
 
         self.scheduled_temp = temp
-        self._set_sensor("scheduled_temp", temp.serialize())
+        self._scheduled_temp_attrs = attrs
+        self._set_sensor("scheduled_temp", temp.serialize(), attrs)
 
         if not send:
             self.log("Not setting the temperature due to send = False.",
                      level="DEBUG")
             return
 
-        if self.get_open_windows():
+        if self.open_window_count:
             self.log("Caching and not setting temperature due to an "
                      "open window.")
             self.wanted_temp = temp
@@ -147,6 +291,8 @@ class Room:
 
         self.app.cancel_timer(timer)
         self.reschedule_timer = None
+        self.reschedule_at = None
+        self.app.store_state(self._store_key("reschedule_at"), None)
         self.log("Cancelled re-schedule timer.", level="DEBUG")
         return True
 
@@ -157,7 +303,7 @@ class Room:
         has been turned off. It returns True if a window is open,
         False otherwise."""
 
-        if self.get_open_windows():
+        if self.open_window_count:
             # window is open, turn heating off
             orig_temp = self.wanted_temp
             open_temp = self.app.cfg["window_open_temp"]
@@ -171,20 +317,41 @@ class Room:
         return False
 
     def eval_temp_expr(
-            self, temp_expr: expr.ExprType
+            self, temp_expr: expr.ExprType,
+            sched_pass: T.Optional[scheduling.SchedulingPass] = None,
+            states: T.Optional[T.Dict[T.Tuple, T.Any]] = None
     ) -> T.Union[expr.ResultBase, None, Exception]:
         """This is a wrapper around expr.eval_temp_expr that adds the
         room_name to the evaluation environment, as well as all configured
         temp_expression_modules. It also catches any exception is raised
         during evaluation. In this case, the caught Exception object
-        is returned."""
+        is returned.
+        If a scheduling pass is given, its environment is used. If a
+        states dictionary is given as well, the entity states read by
+        the expression are recorded in it."""
 
         extra_env = {
             "room_name": self.name,
-        }
+        }  # type: T.Dict[str, T.Any]
+        env = sched_pass.expr_env if sched_pass else None
+
+        if sched_pass is not None and states is not None:
+            _sched_pass = sched_pass
+            _states = states
+
+            def get_state(*args: T.Any, **kwargs: T.Any) -> T.Any:
+                """Records the state read before returning it."""
+
+                state = _sched_pass.get_state(*args, **kwargs)
+                _states[(args, tuple(sorted(kwargs.items())))] = state
+                return state
+
+            extra_env.update(expr.build_state_env(get_state))
 
         try:
-            return expr.eval_temp_expr(temp_expr, self.app, extra_env=extra_env)
+            return expr.eval_temp_expr(
+                temp_expr, self.app, extra_env=extra_env, env=env
+            )
         except Exception as err:  # pylint: disable=broad-except
             self.log("Error while evaluating temperature expression: "
                      "{}".format(repr(err)),
@@ -192,13 +359,22 @@ class Room:
             return err
 
     def eval_schedule(
-            self, sched: schedule.Schedule, when: datetime.datetime
+            self, sched: schedule.Schedule,
+            sched_pass: T.Optional[scheduling.SchedulingPass] = None,
+            record: T.Optional[scheduling.EvaluationRecord] = None
     ) -> T.Optional[T.Tuple[expr.Temp, schedule.Rule]]:
         """Evaluates a schedule, computing the temperature for the time
-        the given datetime object represents. The temperature and the
+        of the given scheduling pass. If no pass is given, a new one
+        containing just this room is created. The temperature and the
         matching rule are returned.
         If no temperature could be found in the schedule (e.g. all
-        rules evaluate to Skip()), None is returned."""
+        rules evaluate to Skip()), None is returned.
+        If an evaluation record is given, the entity states read are
+        added to it and it's marked as untracked when the result depends
+        on something other than these states and the matching rules.
+        The record also receives the final path, partial sums of Add()
+        results and the paths skipped. If the record collects steps,
+        the result of every rule path evaluated is added to them."""
 
         def insert_paths(
                 paths: T.List[schedule.RulePath], first_index: int,
@@ -215,25 +391,31 @@ class Room:
                 first_index += 1
 
         def log(
-                msg: str, path: schedule.RulePath,
+                path: schedule.RulePath, msg: str,
                 *args: T.Any, **kwargs: T.Any
         ) -> None:
             """Wrapper around self.log that prefixes spaces to the
             message based on the length of the rule path."""
 
+            if not self.app.is_logged(kwargs.get("level", "INFO")):
+                return
             prefix = " " * 3 * max(0, len(path.rules) - 1) + "\u251c\u2500"
             self.log("{} {}".format(prefix, msg), *args, **kwargs)
 
-        self.log("Assuming it to be {}.".format(when),
+        if sched_pass is None:
+            sched_pass = scheduling.SchedulingPass(self.app, [self])
+        when = sched_pass.now
+
+        self.log("Assuming it to be {}.", when,
                  level="DEBUG")
 
         rules = list(sched.get_matching_rules(when))
-        self.log("{} / {} rules of {} are currently valid."
-                 .format(len(rules), len(sched.rules), sched),
+        self.log("{} / {} rules of {} are currently valid.",
+                 len(rules), len(sched.rules), sched,
                  level="DEBUG")
 
         result_sum = expr.Add(0)
-        temp_expr_cache = {}  # type: T.Dict[expr.ExprType, T.Union[expr.ResultBase, None, Exception]]
+        temp_expr_cache = {}  # type: scheduling.TempExprCacheType
         paths = []  # type: T.List[schedule.RulePath]
         insert_paths(paths, 0, schedule.RulePath(sched), rules)
         path_idx = 0
@@ -241,140 +423,211 @@ class Room:
             path = paths[path_idx]
             path_idx += 1
 
-            log("{}".format(path), path, level="DEBUG")
+            log(path, "{}", path, level="DEBUG")
 
             last_rule = path.rules[-1]
             if isinstance(last_rule, schedule.SubScheduleRule):
                 _rules = list(last_rule.sub_schedule.get_matching_rules(when))
-                log("{} / {} rules of {} are currently valid."
-                    .format(len(_rules), len(last_rule.sub_schedule.rules),
-                            last_rule.sub_schedule),
-                    path, level="DEBUG")
+                log(path, "{} / {} rules of {} are currently valid.",
+                    len(_rules), len(last_rule.sub_schedule.rules),
+                    last_rule.sub_schedule,
+                    level="DEBUG")
                 insert_paths(paths, path_idx, path, _rules)
                 continue
 
             result = None
             rules_with_temp = path.rules_with_temp
             for rule in reversed(rules_with_temp):
-                # for mypy only
-                assert rule.temp_expr is not None and \
-                       rule.temp_expr_raw is not None
-                if rule.temp_expr_raw in temp_expr_cache:
-                    result = temp_expr_cache[rule.temp_expr_raw]
-                    log("=> {}  [cache-hit]".format(repr(result)),
-                        path, level="DEBUG")
-                else:
-                    result = self.eval_temp_expr(rule.temp_expr)
-                    temp_expr_cache[rule.temp_expr_raw] = result
-                    log("=> {}".format(repr(result)),
-                        path, level="DEBUG")
+                result, cache_hit = sched_pass.eval_rule(
+                    self, path, rule, temp_expr_cache, record
+                )
+                log(path, "=> {!r}{}",
+                    result, "  [cache-hit]" if cache_hit else "",
+                    level="DEBUG")
                 if result is not None:
                     break
 
+            if record is not None and \
+               (result is None or isinstance(result, (Exception, expr.Skip))):
+                record.skipped.append(path)
+
             if result is None:
                 if rules_with_temp:
-                    log("All temperature expressions returned None, "
+                    log(path, "All temperature expressions returned None, "
                         "skipping rule.",
-                        path, level="WARNING")
+                        level="WARNING")
                 else:
-                    log("No temperature definition found, skipping rule.",
-                        path, level="WARNING")
+                    log(path, "No temperature definition found, skipping rule.",
+                        level="WARNING")
             elif isinstance(result, Exception):
-                log("Evaluation failed, skipping rule.",
-                    path, level="DEBUG")
+                log(path, "Evaluation failed, skipping rule.",
+                    level="DEBUG")
             elif isinstance(result, expr.AddibleMixin):
                 result_sum += result
                 if isinstance(result_sum, expr.Result):
-                    self.log("Final result: {}".format(result_sum.value),
+                    self.log("Final result: {}", result_sum.value,
                              level="DEBUG")
+                    if record is not None:
+                        record.path = path
                     return result_sum.value, last_rule
+                if record is not None:
+                    record.add_sums.append((path, result_sum))
             elif isinstance(result, expr.Abort):
                 break
             elif isinstance(result, expr.Break):
-                prefix_size = max(0, len(path.rules) - result.levels)
-                prefix = path.rules[:prefix_size]
+                prefix = path.rules[:max(0, len(path.rules) - result.levels)]
                 while path_idx < len(paths) and \
                       paths[path_idx].root_schedule == path.root_schedule and \
-                      paths[path_idx].rules[:prefix_size] == prefix:
+                      paths[path_idx].rules[:len(prefix)] == prefix:
                     del paths[path_idx]
             elif isinstance(result, expr.IncludeSchedule):
+                if record is not None:
+                    # the times of included schedules aren't known
+                    record.untracked = True
                 _rules = list(result.schedule.get_matching_rules(when))
-                log("{} / {} rules of {} are currently valid."
-                    .format(len(_rules), len(result.schedule.rules),
-                            result.schedule),
-                    path, level="DEBUG")
+                log(path, "{} / {} rules of {} are currently valid.",
+                    len(_rules), len(result.schedule.rules), result.schedule,
+                    level="DEBUG")
                 insert_paths(paths, path_idx,
                              schedule.RulePath(result.schedule), _rules)
 
         self.log("Found no result.", level="DEBUG")
         return None
 
+    def dump_evaluation_trace(self) -> None:
+        """Logs the recent schedule evaluations kept in
+        self.evaluation_trace, regardless of the debug setting."""
+
+        self.log("Trace of the last {} schedule evaluation(s):",
+                 len(self.evaluation_trace))
+        for when, record in self.evaluation_trace:
+            if record.now != when:
+                self.log("{}: reused result of {}: {!r}",
+                         when, record.now, record.result)
+                continue
+            self.log("{}: {!r}{}", when, record.result,
+                     "  [untracked]" if record.untracked else "")
+            for path, result, cache_hit in record.steps or ():
+                self.log("\u251c\u2500 {} => {!r}{}", path, result,
+                         "  [cache-hit]" if cache_hit else "")
+
+    def evaluate_schedule(
+            self, sched_pass: T.Optional[scheduling.SchedulingPass] = None
+    ) -> T.Optional[scheduling.EvaluationRecord]:
+        """Evaluates the room's schedule for the current date and time
+        or that of the given scheduling pass and returns the full
+        evaluation record, including the inputs the result depends on.
+        None is returned if the room has no schedule.
+        The room isn't modified, hence this may run outside of the
+        room's work queue."""
+
+        if self.schedule is None:
+            return None
+        if sched_pass is None:
+            sched_pass = scheduling.SchedulingPass(self.app, [self])
+        record = scheduling.EvaluationRecord(
+            sched_pass.now,
+            scheduling.get_next_run(self._scheduling_times, sched_pass.now),
+            trace=bool(self.evaluation_trace.maxlen)
+        )
+        start = time.perf_counter()
+        record.result = self.eval_schedule(self.schedule, sched_pass, record)
+        record.duration = time.perf_counter() - start
+        return record
+
     def get_open_windows(self) -> T.List[WindowSensor]:
         """Returns a list of window sensors in this room which
-        currently report to be open,"""
+        currently report to be open. The states tracked by the sensors
+        are used, hence no request to AppDaemon is made."""
 
         return list(filter(lambda sensor: sensor.is_open, self.window_sensors))
 
-    def get_scheduled_temp(
-            self,
-    ) -> T.Optional[T.Tuple[expr.Temp, schedule.Rule]]:
-        """Computes and returns the temperature that is configured for
-        the current date and time. The second return value is the rule
-        which generated the result.
-        If no temperature could be found in the schedule (e.g. all
-        rules evaluate to Skip()), None is returned."""
-
-        if self.schedule is None:
-            return None
-        return self.eval_schedule(self.schedule, self.app.datetime())
+    def get_status(self) -> T.Dict[str, T.Any]:
+        """Returns a JSON-serializable snapshot of the room's state.
+        Only the state tracked in memory is used, hence no request to
+        AppDaemon is made."""
+
+        when = self.reschedule_at
+        record = self.last_evaluation
+        return {
+            "friendly_name": self.cfg.get("friendly_name", self.name),
+            "wanted_temp": util.serialize_temp(self.wanted_temp),
+            "scheduled_temp": util.serialize_temp(self.scheduled_temp),
+            "rule": (self._scheduled_temp_attrs or {}).get("rule"),
+            "next_change":
+                record.valid_until.strftime(util.DATETIME_FORMAT)
+                if record is not None and record.valid_until is not None
+                else None,
+            "open_windows": [sensor.entity_id
+                             for sensor in self.get_open_windows()],
+            "reschedule_at": when.strftime(util.DATETIME_FORMAT)
+                             if when is not None else None,
+            "settling": self._settle_timer is not None,
+            "thermostats": {therm.entity_id: therm.get_status()
+                            for therm in self.thermostats},
+        }
 
-    def initialize(self) -> None:
+    def initialize(self, states: T.Dict[str, T.Any]) -> None:
         """Should be called after all schedules, thermostats and window
-        sensors have been added in order to register state listeners
-        and timers."""
+        sensors have been added and the thermostats have been initialized
+        in order to register state listeners and timers. states is a
+        dictionary of entity states, as returned
+        by get_state() without arguments, to initialize the window
+        sensors and restore the last scheduled temperature from."""
 
         self.log("Initializing room (name={})."
                  .format(repr(self.name)),
                  level="DEBUG")
 
-        _scheduled_temp = self._get_sensor("scheduled_temp")
-        try:
-            self.scheduled_temp = expr.Temp(_scheduled_temp)
-        except ValueError:
-            self.log("Last scheduled temperature is unknown.",
-                     level="DEBUG")
+        self.evaluation_trace = collections.deque(
+            maxlen=self.app.cfg["evaluation_trace_size"]
+        )
+
+        if self.app.state_store is not None:
+            self._restore_stored_state()
         else:
-            self.log("Last scheduled temperature was {}."
-                     .format(self.scheduled_temp),
-                     level="DEBUG")
+            _scheduled_temp = self._get_sensor("scheduled_temp", states)
+            try:
+                self._scheduled_temp = expr.Temp(_scheduled_temp)
+            except ValueError:
+                self.log("Last scheduled temperature is unknown.",
+                         level="DEBUG")
+            else:
+                self.log("Last scheduled temperature was {}."
+                         .format(self._scheduled_temp),
+                         level="DEBUG")
 
-        # initialize all thermostats first to fetch their states,
-        # then listen to the target_temp_changed event
-        for therm in self.thermostats:
-            therm.initialize()
+        # the thermostats have fetched their states already, now
+        # listen to the target_temp_changed event
         for therm in self.thermostats:
             therm.events.on(
                 "target_temp_changed", self.notify_target_temp_changed
             )
 
         for wsensor in self.window_sensors:
-            wsensor.initialize()
+            wsensor.initialize((states.get(wsensor.entity_id) or {}).get("state"))
             wsensor.events.on("open_close", self.notify_window_action)
+        self.open_window_count = len(self.get_open_windows())
 
         if self.schedule:
             times = self.schedule.get_scheduling_times()
-            self.log("Registering scheduling timers at: {{{}}}"
+            self._scheduling_times = frozenset(times)
+            self.log("Registering scheduling times: {{{}}}"
                      .format(", ".join([str(_time) for _time in times])),
                      level="DEBUG")
-            for _time in times:
-                self.app.run_daily(self._schedule_timer_cb, _time)
+            self.app.scheduling_timer.register(self, times)
         else:
             self.log("No schedule configured.", level="DEBUG")
 
     def log(self, msg: str, *args: T.Any, **kwargs: T.Any) -> None:
-        """Prefixes the room to log messages."""
-        msg = "[{}] {}".format(self, msg)
-        self.app.log(msg, *args, **kwargs)
+        """Prefixes the room to log messages.
+        Nothing is formatted if the message isn't going to be logged."""
+
+        if not self.app.is_logged(kwargs.get("level", "INFO")):
+            return
+        if args:
+            msg = msg.format(*args)
+        self.app.log("[{}] {}".format(self, msg), **kwargs)
 
     def notify_set_temp_event(
             self, temp_expr: expr.ExprType, force_resend: bool = False,
@@ -391,9 +644,18 @@ class Room:
             self, therm: "Thermostat", temp: expr.Temp,
     ) -> None:
         """Should be called when the temperature has been changed
-        externally by manual adjustment at a thermostat."""
+        externally by manual adjustment at a thermostat.
+        Confirmations of temperatures Heaty sent itself are ignored.
+        Changes are handled after no further change has been reported
+        for replicate_settle_time seconds, only the last one counts."""
+
+        if therm.is_echo(temp):
+            self.log("Ignoring {} reported by {}, it was sent by Heaty.",
+                     temp, therm,
+                     level="DEBUG")
+            return
 
-        if self.get_open_windows():
+        if self.open_window_count:
             # After window has been opened and heating turned off,
             # thermostats usually report to be off, but we don't
             # care to not mess up self.wanted_temp and prevent
@@ -409,16 +671,20 @@ class Room:
 
         neutral_temp = temp - therm.cfg["delta"]
 
-        if self.cfg["replicate_changes"] and len(self.thermostats) > 1:
-            self.log("Propagating the change to all thermostats "
-                     "in the room.",
-                     prefix=common.LOG_PREFIX_OUTGOING)
-            self.set_temp(neutral_temp, scheduled=False)
+        settle_time = self.cfg["replicate_settle_time"]
+        if not settle_time:
+            self._handle_manual_change(neutral_temp)
+            return
 
-        if neutral_temp == self.wanted_temp:
-            self.cancel_reschedule_timer()
-        elif self.cfg["reschedule_delay"]:
-            self.start_reschedule_timer(restart=True)
+        self._settle_temp = neutral_temp
+        if self._settle_timer is not None:
+            self.app.cancel_timer(self._settle_timer)
+        self.log("Waiting {} seconds for the thermostats to settle.",
+                 settle_time,
+                 level="DEBUG")
+        self._settle_timer = self.app.run_in(
+            self.work_queue.wrap(self._settle_timer_cb), settle_time
+        )
 
     def notify_window_action(self, sensor: WindowSensor, is_open: bool) -> None:  # pylint: disable=unused-argument
         """This method reacts on window opened/closed events.
@@ -429,13 +695,15 @@ class Room:
         self.log("Window has been {}.".format(action),
                  prefix=common.LOG_PREFIX_INCOMING)
 
+        self.open_window_count += 1 if is_open else -1
+
         if not self.app.require_master_is_on():
             return
 
         if is_open:
             # turn heating off, but store the original temperature
             self.check_for_open_window()
-        elif not self.get_open_windows():
+        elif not self.open_window_count:
             # all windows closed
             # restore temperature from before opening the window
             orig_temp = self.wanted_temp
@@ -463,18 +731,18 @@ class Room:
         if scheduled and not self.app.require_master_is_on():
             return
 
-        self.log("Setting temperature to {}.  [{}{}]"
-                 .format(target_temp,
-                         "scheduled" if scheduled else "manual",
-                         ", force re-sending" if force_resend else ""),
+        self.log("Setting temperature to {}.  [{}{}]",
+                 target_temp, "scheduled" if scheduled else "manual",
+                 ", force re-sending" if force_resend else "",
                  level="DEBUG")
 
         self.wanted_temp = target_temp
 
         changed = False
-        for therm in self.thermostats:
-            result = therm.set_temp(target_temp, force_resend=force_resend)
-            changed = changed or bool(result)
+        with self.app.service_batcher.collect():
+            for therm in self.thermostats:
+                result = therm.set_temp(target_temp, force_resend=force_resend)
+                changed = changed or bool(result)
 
         if changed:
             self.log("Temperature set to {}.  [{}]"
@@ -499,13 +767,13 @@ class Room:
             return
 
         result = self.eval_temp_expr(temp_expr)
-        self.log("Evaluated temperature expression {} to {}."
-                 .format(repr(temp_expr), repr(result)),
+        self.log("Evaluated temperature expression {!r} to {!r}.",
+                 temp_expr, result,
                  level="DEBUG")
 
         temp = None
         if isinstance(result, expr.IncludeSchedule):
-            _result = self.eval_schedule(result.schedule, self.app.datetime())
+            _result = self.eval_schedule(result.schedule)
             if _result is not None:
                 temp = _result[0]
         elif isinstance(result, expr.Result):
@@ -515,7 +783,7 @@ class Room:
             self.log("Ignoring temperature expression.")
             return
 
-        if self.get_open_windows():
+        if self.open_window_count:
             self.log("Caching and not setting temperature due to an"
                      "open window.")
             self.wanted_temp = temp
@@ -555,6 +823,12 @@ class Room:
         when = self.app.datetime() + delta
         self.log("Re-scheduling not before {} ({})."
                  .format(util.format_time(when.time()), delta))
-        self.reschedule_timer = self.app.run_at(self._reschedule_timer_cb, when)
+        self.reschedule_timer = self.app.run_at(
+            self.work_queue.wrap(self._reschedule_timer_cb), when
+        )
+        self.reschedule_at = when
+        self.app.store_state(
+            self._store_key("reschedule_at"), when.strftime(util.DATETIME_FORMAT)
+        )
 
         return True
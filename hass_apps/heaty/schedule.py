@@ -12,6 +12,8 @@ from . import expr, util
 class Rule:
     """A rule that can be added to a schedule."""
 
+    # pylint: disable=too-many-instance-attributes
+
     # names of schedule rule constraints to be fetched from a rule definition
     CONSTRAINTS = ("years", "months", "days", "weeks", "weekdays",
                    "start_date", "end_date")
@@ -50,6 +52,8 @@ class Rule:
 
         self.temp_expr = None  # type: T.Optional[expr.ExprType]
         self.temp_expr_raw = None  # type: T.Optional[expr.ExprType]
+        # global names referenced by the temperature expression
+        self.temp_expr_names = frozenset()  # type: T.FrozenSet[str]
         if temp_expr is not None:
             if isinstance(temp_expr, str):
                 temp_expr = temp_expr.strip()
@@ -59,6 +63,8 @@ class Rule:
             except ValueError:
                 # this is a temperature expression, precompile it
                 self.temp_expr = compile(temp_expr, "temp_expr", "eval")  # type: expr.ExprType
+                self.temp_expr_names = \
+                    expr.get_referenced_names(self.temp_expr)
             else:
                 self.temp_expr = temp
 
@@ -133,6 +139,21 @@ class Rule:
             return self.end_plus_days > 1
         return self.end_plus_days >= 1
 
+    @property
+    def signature(self) -> T.Tuple:
+        """A hashable tuple describing this rule. Rules with equal
+        signatures behave identically."""
+
+        constraints = []
+        for name, value in sorted(self.constraints.items()):
+            if isinstance(value, dict):
+                value = tuple(sorted(value.items()))
+            elif isinstance(value, (list, set)):
+                value = tuple(sorted(value))
+            constraints.append((name, value))
+        return (type(self), self.name, self.start_time, self.end_time,
+                self.end_plus_days, tuple(constraints), self.temp_expr_raw)
+
 
 class RulePath:
     """A chain of rules starting from a root schedule through sub-schedule
@@ -221,6 +242,12 @@ class SubScheduleRule(Rule):
         tokens.insert(0, "with sub-schedule")
         return tokens
 
+    @property
+    def signature(self) -> T.Tuple:
+        """Adds the sub-schedule's signature."""
+
+        return super().signature + (self.sub_schedule.signature,)
+
 
 class Schedule:
     """Holds the schedule for a room with all its rules."""
@@ -316,6 +343,16 @@ class Schedule:
 
         return min(map(map_func, times))
 
+    def get_referenced_names(self) -> T.Set[str]:
+        """Returns the global names referenced by the temperature
+        expressions of this schedule's rules, including the rules of
+        sub-schedules."""
+
+        names = set()  # type: T.Set[str]
+        for path in self.unfold():
+            names.update(path.rules[-1].temp_expr_names)
+        return names
+
     def get_scheduling_times(self) -> T.Set[datetime.time]:
         """Returns a set of times a re-scheduling should be triggered
         at. Rules of sub-schedules are considered as well."""
@@ -327,6 +364,13 @@ class Schedule:
                     times.update((rule.start_time, rule.end_time,))
         return times
 
+    @property
+    def signature(self) -> T.Tuple:
+        """A hashable tuple made of the signatures of this schedule's
+        rules. The name isn't part of it."""
+
+        return tuple(rule.signature for rule in self.rules)
+
     def unfold(self) -> T.Iterator[RulePath]:
         """Returns an iterator over rule paths.
         The last rule of a path may either be a SubScheduleRule (meaning
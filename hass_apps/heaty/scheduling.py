@@ -0,0 +1,455 @@
+"""
+This module implements the SchedulingPass class, which evaluates and
+applies the schedules of multiple rooms at once, and the SchedulingTimer
+triggering these passes at the times rooms need to be re-scheduled.
+EvaluationRecord objects remember what a room's last evaluation
+depended on, so that passes can skip rooms whose inputs didn't change.
+"""
+
+import typing as T
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    import uuid
+    from .app import HeatyApp
+    from .room import Room
+
+import copy
+import datetime
+import time
+
+from . import expr, schedule
+
+
+# names whose values change with time or can't be tracked, expressions
+# referencing them are re-evaluated in every pass
+UNTRACKED_NAMES = frozenset(("app", "date", "datetime", "now", "time"))
+
+# outcome of evaluating a temperature expression
+EvalResultType = T.Union[expr.ResultBase, None, Exception]
+# maps temperature expressions to their result and the states read
+TempExprCacheType = T.Dict[
+    expr.ExprType, T.Tuple[EvalResultType, T.Dict[T.Tuple, T.Any]]
+]
+# a rule path evaluated, its result and whether it came from a cache
+EvalStepType = T.Tuple[schedule.RulePath, EvalResultType, bool]
+
+
+class EvaluationRecord:
+    """The full outcome of a room's schedule evaluation. Besides the
+    result, it records how the result came about (the rule path that
+    produced it, partial sums of Add() results and the paths skipped)
+    and the inputs it depended on. These inputs are the period of time
+    during which the set of matching rules stays the same, hence the
+    time of the next possible change, and the entity states read by
+    temperature expressions. The result may be reused for as long as
+    all of them are unchanged."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+            self, now: datetime.datetime,
+            valid_until: T.Optional[datetime.datetime],
+            trace: bool = False
+    ) -> None:
+        self.now = now
+        # None means that the matching rules never change
+        self.valid_until = valid_until
+        self.states = {}  # type: T.Dict[T.Tuple, T.Any]
+        self.untracked = False
+        self.result = None  # type: T.Optional[T.Tuple[expr.Temp, schedule.Rule]]
+        # the path leading to the final result
+        self.path = None  # type: T.Optional[schedule.RulePath]
+        # the sum of Add() results after each path producing one
+        self.add_sums = []  # type: T.List[T.Tuple[schedule.RulePath, expr.ResultBase]]
+        # paths that produced no usable result
+        self.skipped = []  # type: T.List[schedule.RulePath]
+        # seconds the evaluation took
+        self.duration = 0.0
+        # the rule paths evaluated
+        self.steps = [] if trace else None  # type: T.Optional[T.List[EvalStepType]]
+
+    def __repr__(self) -> str:
+        return "<EvaluationRecord at {}, {} states{}>".format(
+            self.now, len(self.states),
+            ", untracked" if self.untracked else ""
+        )
+
+    def is_valid_for(self, sched_pass: "SchedulingPass") -> bool:
+        """Tells whether the recorded result is still valid at the time
+        of the given scheduling pass, using the pass' state snapshot
+        to compare the entity states read."""
+
+        if self.untracked:
+            return False
+        if sched_pass.now < self.now:
+            return False
+        if self.valid_until is not None and sched_pass.now >= self.valid_until:
+            return False
+        for (args, kwargs), state in self.states.items():
+            if sched_pass.get_state(*args, **dict(kwargs)) != state:
+                return False
+        return True
+
+    def add_result(
+            self, path: schedule.RulePath, result: EvalResultType,
+            states: T.Dict[T.Tuple, T.Any], cache_hit: bool,
+            untracked: bool
+    ) -> None:
+        """Records the result of the temperature expression evaluated
+        for the given path's final rule together with the entity states
+        it read. untracked tells whether the expression depends on
+        something else, failed expressions are always untracked."""
+
+        self.states.update(states)
+        if untracked or isinstance(result, Exception):
+            self.untracked = True
+        if self.steps is not None:
+            self.steps.append((path, result, cache_hit))
+
+    def for_schedule(
+            self, root_schedule: schedule.Schedule
+    ) -> "EvaluationRecord":
+        """Returns a copy of this record with all rule paths starting at
+        the given root schedule instead, which has to consist of the
+        same rules. Rooms sharing the result of another room get such
+        a copy, so that it refers to their own schedule."""
+
+        def rebase(path: schedule.RulePath) -> schedule.RulePath:
+            """Returns a copy of path starting at root_schedule."""
+
+            _path = copy.copy(path)
+            _path.root_schedule = root_schedule
+            _path.rules = list(path.rules)
+            return _path
+
+        record = copy.copy(self)
+        if self.path is not None:
+            record.path = rebase(self.path)
+        record.add_sums = [(rebase(path), result)
+                           for path, result in self.add_sums]
+        record.skipped = [rebase(path) for path in self.skipped]
+        if self.steps is not None:
+            record.steps = [(rebase(path), result, cached)
+                            for path, result, cached in self.steps]
+        return record
+
+    @property
+    def rule(self) -> T.Optional[schedule.Rule]:
+        """The rule which produced the result or None, if there is no
+        result."""
+
+        return self.result[1] if self.result else None
+
+    @property
+    def temp(self) -> T.Optional[expr.Temp]:
+        """The resulting temperature or None, if the schedule produced
+        no result."""
+
+        return self.result[0] if self.result else None
+
+
+class SchedulingPass:
+    """A single run of schedule evaluation for a set of rooms.
+    All rooms are evaluated against the same point in time, share
+    a snapshot of the entity states read and a cache for the results
+    of temperature expressions that don't depend on the room. The
+    results are applied not before all rooms have been evaluated."""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+            self, app: "HeatyApp", rooms: T.Iterable["Room"],
+            now: T.Optional[datetime.datetime] = None,
+            states: T.Optional[T.Dict[str, T.Any]] = None
+    ) -> None:
+        self.app = app
+        self.rooms = list(rooms)
+        if now is None:
+            now = app.datetime()
+        self.now = now
+        self.states = {}  # type: T.Dict[T.Tuple, T.Any]
+        if states is not None:
+            # states of all entities, as returned by get_state() without
+            # arguments, are used instead of asking AppDaemon again
+            for entity_id, state in states.items():
+                self.states[((entity_id,), ())] = state.get("state")
+                self.states[((entity_id,), (("attribute", "all"),))] = state
+        # results of temperature expressions not referencing room_name
+        # values are tuples of the result and the states read
+        self.temp_expr_cache = {}  # type: TempExprCacheType
+        self.evaluated = 0
+        self.shared = 0
+        self.skipped = 0
+        self._expr_env = None  # type: T.Optional[T.Dict[str, T.Any]]
+
+    def __repr__(self) -> str:
+        return "<SchedulingPass for {} rooms at {}>" \
+               .format(len(self.rooms), self.now)
+
+    def _apply(
+            self, room: "Room", record: T.Optional[EvaluationRecord],
+            send: bool, force_resend: bool
+    ) -> None:
+        """Keeps the given evaluation record as the room's last one and
+        applies its result, unless a re-schedule timer runs in the room.
+        This is meant to be run through the room's work queue, so that
+        timers cancelled by jobs queued before are taken into account."""
+
+        if record is not None:
+            room.last_evaluation = record
+            room.evaluation_trace.append((self.now, record))
+
+        if room.reschedule_timer is not None:
+            # don't schedule now, wait for the timer instead
+            room.log("Not scheduling now due to a running re-schedule "
+                     "timer.",
+                     level="DEBUG")
+            return
+
+        room.apply_scheduled_temp(record, send=send, force_resend=force_resend)
+
+    def _evaluate(
+            self, rooms: T.List["Room"]
+    ) -> T.List[T.Tuple["Room", T.Optional[EvaluationRecord]]]:
+        """Evaluates the schedules of the given rooms and returns a list
+        of (room, record) tuples in the order of the rooms. The record
+        is None for rooms without a schedule.
+        Rooms whose last evaluation is still valid aren't evaluated
+        again, their last result is reused instead. Of rooms sharing
+        the same schedule key, only the first one is evaluated.
+        If the app has a thread pool for evaluation, the rooms are
+        evaluated concurrently.
+        The rooms themselves aren't modified, that's left to _apply()."""
+
+        records = {}  # type: T.Dict[Room, T.Optional[EvaluationRecord]]
+        dirty = []
+        # rooms to take the result of another room with the same schedule
+        followers = []  # type: T.List[T.Tuple[Room, Room]]
+        leaders = {}  # type: T.Dict[T.Tuple[schedule.Rule, ...], Room]
+        for room in rooms:
+            room.log("Applying room's schedule.",
+                     level="DEBUG")
+            record = room.last_evaluation
+            if record is not None and record.is_valid_for(self):
+                room.log("Inputs of the last evaluation are unchanged, "
+                         "reusing its result.",
+                         level="DEBUG")
+                records[room] = record
+                self.skipped += 1
+            elif room.schedule_key in leaders:
+                followers.append((room, leaders[room.schedule_key]))
+            else:
+                if room.schedule_key is not None:
+                    leaders[room.schedule_key] = room
+                dirty.append(room)
+
+        executor = self.app.evaluation_executor
+        if executor is None or len(dirty) < 2:
+            for room in dirty:
+                records[room] = room.evaluate_schedule(self)
+        else:
+            # build the environment once before the threads start using it
+            self.expr_env  # pylint: disable=pointless-statement
+            futures = [executor.submit(room.evaluate_schedule, self)
+                       for room in dirty]
+            for room, future in zip(dirty, futures):
+                records[room] = future.result()
+        self.evaluated += len(dirty)
+
+        for room, leader in followers:
+            room.log("Sharing the result of {} with an identical schedule.",
+                     leader,
+                     level="DEBUG")
+            record = records[leader]
+            if record is not None and room.schedule is not None:
+                record = record.for_schedule(room.schedule)
+            records[room] = record
+            self.shared += 1
+
+        return [(room, records[room]) for room in rooms]
+
+    def eval_rule(
+            self, room: "Room", path: schedule.RulePath, rule: schedule.Rule,
+            room_cache: TempExprCacheType,
+            record: T.Optional[EvaluationRecord] = None
+    ) -> T.Tuple[EvalResultType, bool]:
+        """Evaluates the temperature expression of a rule in the given
+        path for room and returns the result, together with whether it
+        came from a cache. Results of expressions not depending on the
+        room are shared with the other rooms of this pass, the others
+        are cached in room_cache. If an evaluation record is given,
+        the result is added to it."""
+
+        # for mypy only
+        assert rule.temp_expr is not None and rule.temp_expr_raw is not None
+        names = rule.temp_expr_names
+        cache = room_cache if "room_name" in names else self.temp_expr_cache
+        cache_hit = rule.temp_expr_raw in cache
+        if cache_hit:
+            result, states = cache[rule.temp_expr_raw]
+        else:
+            states = {}
+            result = room.eval_temp_expr(rule.temp_expr, self, states=states)
+            cache[rule.temp_expr_raw] = result, states
+        if record is not None:
+            untracked = not UNTRACKED_NAMES.isdisjoint(names) or \
+                        not names.isdisjoint(self.app.temp_expression_modules)
+            record.add_result(path, result, states, cache_hit, untracked)
+        return result, cache_hit
+
+    @property
+    def expr_env(self) -> T.Dict[str, T.Any]:
+        """The environment for evaluating temperature expressions during
+        this pass. It's built on first access."""
+
+        if self._expr_env is None:
+            self._expr_env = expr.build_expr_env(
+                self.app, now=self.now, get_state=self.get_state
+            )
+        return self._expr_env
+
+    def get_state(self, *args: T.Any, **kwargs: T.Any) -> T.Any:
+        """A wrapper around app.get_state() that asks AppDaemon only
+        once per pass for every distinct set of arguments."""
+
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            return self.states[key]
+        except KeyError:
+            state = self.app.get_state(*args, **kwargs)
+            self.states[key] = state
+            return state
+
+    def run(self, send: bool = True, force_resend: bool = False) -> None:
+        """Evaluates the schedules of all rooms of this pass and
+        applies the results afterwards. The meaning of send and
+        force_resend is the same as for Room.apply_schedule()."""
+
+        if not self.rooms:
+            return
+
+        start = time.perf_counter()
+        results = self._evaluate(self.rooms)
+        evaluated = time.perf_counter()
+
+        # service calls of all rooms are combined where possible
+        with self.app.service_batcher.collect():
+            for room, record in results:
+                # rooms may be busy in other threads, the result is
+                # applied once they're done
+                room.work_queue.submit(
+                    self._apply, room, record, send, force_resend
+                )
+        applied = time.perf_counter()
+
+        stats = self.app.evaluation_stats
+        stats["evaluated"] += self.evaluated
+        stats["shared"] += self.shared
+        stats["skipped"] += self.skipped
+        self.app.log("Scheduling pass for {} room(s) took {:.3f}s "
+                     "(evaluation: {:.3f}s, applying: {:.3f}s), {} "
+                     "evaluation(s) skipped, {} shared ({} evaluated, "
+                     "{} skipped, {} shared in total).",
+                     len(self.rooms), applied - start,
+                     evaluated - start, applied - evaluated,
+                     self.skipped, self.shared, stats["evaluated"],
+                     stats["skipped"], stats["shared"],
+                     level="DEBUG")
+
+
+class SchedulingTimer:
+    """A single timer shared by all rooms. Rooms register the times of
+    day at which they need to be re-scheduled. The timer fires at the
+    next of these times and runs a scheduling pass for just the rooms
+    registered for that time before re-arming itself."""
+
+    def __init__(self, app: "HeatyApp") -> None:
+        self.app = app
+        self.rooms_by_time = {}  # type: T.Dict[datetime.time, T.List[Room]]
+        self._timer = None  # type: T.Optional[uuid.UUID]
+        self._next_run = None  # type: T.Optional[datetime.datetime]
+
+    def __repr__(self) -> str:
+        return "<SchedulingTimer for {} times, next run at {}>" \
+               .format(len(self.rooms_by_time), self._next_run)
+
+    def _rearm(self, after: T.Optional[datetime.datetime] = None) -> None:
+        """Arms the timer for the next registered time. The timer is
+        left alone if it's running for that time already."""
+
+        if after is None:
+            after = self.app.datetime()
+        next_run = get_next_run(self.rooms_by_time, after)
+        if next_run == self._next_run and self._timer is not None:
+            return
+
+        if self._timer is not None:
+            self.app.cancel_timer(self._timer)
+            self._timer = None
+        self._next_run = next_run
+        if next_run is not None:
+            self._timer = self.app.run_at(
+                self.app.work_queue.wrap(self._timer_cb), next_run
+            )
+
+    def _remove(self, room: "Room") -> None:
+        """Removes the given room from all registered times."""
+
+        for _time in list(self.rooms_by_time):
+            rooms = self.rooms_by_time[_time]
+            if room in rooms:
+                rooms.remove(room)
+                if not rooms:
+                    del self.rooms_by_time[_time]
+
+    def _timer_cb(self, kwargs: dict) -> None:
+        """Runs a scheduling pass for the rooms registered for the time
+        the timer fired for and re-arms the timer."""
+
+        fired = self._next_run
+        self._timer = None
+        assert fired is not None
+        rooms = list(self.rooms_by_time.get(fired.time(), []))
+        # continue with the time following the one just handled, even
+        # if AppDaemon's clock differs slightly
+        self._rearm(after=fired)
+
+        self.app.log("Scheduling timer fired for {} room(s).", len(rooms),
+                     level="DEBUG")
+        self.app.apply_schedules(rooms=rooms)
+
+    def register(self, room: "Room", times: T.Iterable[datetime.time]) -> None:
+        """Registers the times of day at which the given room needs to
+        be re-scheduled, replacing the times registered before. The
+        timer is re-armed if the next time has changed."""
+
+        self._remove(room)
+        for _time in times:
+            self.rooms_by_time.setdefault(_time, []).append(room)
+        self._rearm()
+
+    def unregister(self, room: "Room") -> None:
+        """Removes all times registered for the given room and re-arms
+        the timer if the next time has changed."""
+
+        self._remove(room)
+        self._rearm()
+
+
+def get_next_run(
+        times: T.Iterable[datetime.time], after: datetime.datetime
+) -> T.Optional[datetime.datetime]:
+    """Returns the next datetime later than after with one of the given
+    times of day or None, if no times are given."""
+
+    today = after.date()
+    tomorrow = today + datetime.timedelta(days=1)
+    next_run = None
+    for _time in times:
+        run = datetime.datetime.combine(today, _time)
+        if run <= after:
+            # midnight transition
+            run = datetime.datetime.combine(tomorrow, _time)
+        if next_run is None or run < next_run:
+            next_run = run
+    return next_run
@@ -11,7 +11,7 @@ if T.TYPE_CHECKING:
     from .room import Room
 
 from .. import common
-from . import util
+from . import util, workqueue
 
 
 class _WeightedValue:
@@ -35,6 +35,8 @@ class StatisticsZone:
         self.app = app
         self.rooms = []  # type: T.List[Room]
         self._stats_timer = None  # type: T.Optional[uuid.UUID]
+        # thermostats of different rooms report concurrently
+        self.work_queue = workqueue.WorkQueue(self.log)
 
     def __repr__(self) -> str:
         return "<StatisticsZone {}>".format(self.name)
@@ -66,7 +68,7 @@ class StatisticsZone:
                     factor = cfg["thermostat_factors"].get(therm.entity_id, 1)
                     temp_delta *= factor
                 value = _WeightedValue(temp_delta, weight)
-                self.log("Value for {} in {} is {}".format(therm, room, value),
+                self.log("Value for {} in {} is {}", therm, room, value,
                          level="DEBUG")
                 values.append(value)
         return values
@@ -83,7 +85,7 @@ class StatisticsZone:
 
         params = {}  # type: T.Dict[str, T.List[_WeightedValue]]
         for param in self.cfg["parameters"]:
-            self.log("Collecting {}".format(param),
+            self.log("Collecting {}", param,
                      level="DEBUG")
             cfg = self.cfg["parameters"][param]
             params[param] = getattr(self, "_collect_{}".format(param))(cfg)
@@ -94,8 +96,8 @@ class StatisticsZone:
             _avg = fmt(sum([v.value * v.weight for v in values]) /
                        sum([v.weight for v in values]) if values else 0)
             _max = fmt(max([v.value for v in values]) if values else 0)
-            self.log("{} (min/avg/max): {} / {} / {}"
-                     .format(param, _min, _avg, _max),
+            self.log("{} (min/avg/max): {} / {} / {}",
+                     param, _min, _avg, _max,
                      level="DEBUG")
             self._set_sensor("min_{}".format(param), _min)
             self._set_sensor("avg_{}".format(param), _avg)
@@ -106,8 +108,7 @@ class StatisticsZone:
 
         entity_id = "sensor.heaty_{}_zone_{}_{}" \
                     .format(self.app.cfg["heaty_id"], self.name, param)
-        self.log("Setting state of {} to {}."
-                 .format(repr(entity_id), repr(state)),
+        self.log("Setting state of {!r} to {!r}.", entity_id, state,
                  level="DEBUG", prefix=common.LOG_PREFIX_OUTGOING)
         self.app.set_state(entity_id, state=state)
 
@@ -115,8 +116,7 @@ class StatisticsZone:
         """Fetches the Room objects and sets up internal data structures
         before triggering an initial statistics update."""
 
-        self.log("Initializing statistics zone (name={})."
-                 .format(repr(self.name)),
+        self.log("Initializing statistics zone (name={!r}).", self.name,
                  level="DEBUG")
 
         if not self.cfg["parameters"]:
@@ -132,13 +132,17 @@ class StatisticsZone:
                 continue
             self.rooms.append(room)
             for therm in room.thermostats:
-                self.log("Listening for temperature changes of {} in {}."
-                         .format(therm, room),
+                self.log("Listening for temperature changes of {} in {}.",
+                         therm, room,
                          level="DEBUG")
-                therm.events.on("current_temp_changed",
-                                lambda *a, **kw: self.update_stats())
-                therm.events.on("target_temp_changed",
-                                lambda *a, **kw: self.update_stats())
+                therm.events.on(
+                    "current_temp_changed",
+                    lambda *a, **kw: self.work_queue.submit(self.update_stats)
+                )
+                therm.events.on(
+                    "target_temp_changed",
+                    lambda *a, **kw: self.work_queue.submit(self.update_stats)
+                )
 
         if not self.rooms:
             self.log("No rooms configured.", level="WARNING")
@@ -146,9 +150,14 @@ class StatisticsZone:
         self.update_stats()
 
     def log(self, msg: str, *args: T.Any, **kwargs: T.Any) -> None:
-        """Prefixes the zone to log messages."""
-        msg = "[{}] {}".format(self, msg)
-        self.app.log(msg, *args, **kwargs)
+        """Prefixes the zone to log messages.
+        Nothing is formatted if the message isn't going to be logged."""
+
+        if not self.app.is_logged(kwargs.get("level", "INFO")):
+            return
+        if args:
+            msg = msg.format(*args)
+        self.app.log("[{}] {}".format(self, msg), **kwargs)
 
     def update_stats(self) -> None:
         """Registers a timer for sending statistics to HA in 3 seconds."""
@@ -161,5 +170,5 @@ class StatisticsZone:
         self.log("Going to update statistics in 3 seconds.",
                  level="DEBUG")
         self._stats_timer = self.app.run_in(
-            lambda *a: self._do_update_stats(), 3
+            lambda *a: self.work_queue.submit(self._do_update_stats), 3
         )
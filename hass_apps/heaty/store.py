@@ -0,0 +1,95 @@
+"""
+This module implements the StateStore class, which persists Heaty's
+state locally to speed up restarts.
+"""
+
+import typing as T
+
+import json
+import sqlite3
+import threading
+
+
+class StoreError(Exception):
+    """Raised when the store can't be read or written."""
+
+
+class StateStore:
+    """A persistent key/value store backed by a SQLite database.
+    Values are stored as JSON. Every change is written immediately,
+    while all values are read at once when the store is loaded."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = None  # type: T.Optional[sqlite3.Connection]
+        # AppDaemon runs callbacks in multiple threads
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return "<StateStore {}>".format(repr(self.path))
+
+    def close(self) -> None:
+        """Closes the database. The store must be loaded again
+        before further use."""
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def load(self) -> T.Dict[str, T.Any]:
+        """Opens the database, creating it if necessary, and returns
+        all stored values as a dictionary.
+        A StoreError is raised when the database can't be opened."""
+
+        with self._lock:
+            try:
+                self._db = sqlite3.connect(
+                    self.path, check_same_thread=False, isolation_level=None
+                )
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS state "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+                rows = self._db.execute(
+                    "SELECT key, value FROM state"
+                ).fetchall()
+            except sqlite3.Error as err:
+                self._db = None
+                raise StoreError(
+                    "can't load {}: {}".format(repr(self.path), err)
+                ) from err
+
+        values = {}
+        for key, value in rows:
+            try:
+                values[key] = json.loads(value)
+            except ValueError:
+                continue
+        return values
+
+    def set(self, key: str, value: T.Any) -> None:
+        """Stores the given value under key. A value of None removes
+        the key from the store.
+        A StoreError is raised when the value can't be written."""
+
+        with self._lock:
+            if self._db is None:
+                raise StoreError("{} hasn't been loaded".format(self))
+            try:
+                if value is None:
+                    self._db.execute(
+                        "DELETE FROM state WHERE key = ?", (key,)
+                    )
+                else:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO state (key, value) "
+                        "VALUES (?, ?)",
+                        (key, json.dumps(value))
+                    )
+            except sqlite3.Error as err:
+                raise StoreError(
+                    "can't write {} to {}: {}".format(repr(key), self, err)
+                ) from err
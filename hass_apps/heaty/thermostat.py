@@ -5,14 +5,13 @@ This module implements the Thermostat class.
 import typing as T
 if T.TYPE_CHECKING:
     # pylint: disable=cyclic-import,unused-import
-    import uuid
     from .room import Room
 
-import copy
+import datetime
 import observable
 
 from .. import common
-from . import expr
+from . import expr, retry, util
 
 
 class Thermostat:
@@ -28,86 +27,90 @@ class Thermostat:
         self.current_temp = None  # type: T.Optional[expr.Temp]
         self.current_target_temp = None  # type: T.Optional[expr.Temp]
         self.wanted_temp = None  # type: T.Optional[expr.Temp]
-        self.resend_timer = None  # type: T.Optional[uuid.UUID]
+        # when the app's retry scheduler re-sends what to this thermostat
+        self.resend_at = None  # type: T.Optional[datetime.datetime]
+        self._resend = None  # type: T.Optional[T.Dict[str, T.Any]]
+        # target temperatures sent recently and when they were sent
+        self._sent_temps = {}  # type: T.Dict[expr.Temp, datetime.datetime]
         self.events = observable.Observable()  # type: observable.Observable
 
+        # names of the state attributes to read, None if not to be read
+        self._opmode_attr = cfg["opmode_state_attr"] \
+                            if cfg["supports_opmodes"] else None
+        self._target_temp_attr = cfg["target_temp_state_attr"] \
+                                 if cfg["supports_temps"] else None
+        self._current_temp_attr = cfg["current_temp_state_attr"] \
+                                  if cfg["supports_temps"] else None
+        # changes of other attributes are ignored
+        self._relevant_attrs = tuple(
+            attr for attr in (self._opmode_attr, self._target_temp_attr,
+                              self._current_temp_attr)
+            if attr
+        )
+
     def __repr__(self) -> str:
         return "<Thermostat {}>".format(str(self))
 
     def __str__(self) -> str:
         return "T:{}".format(self.cfg.get("friendly_name", self.entity_id))
 
-    def _check_config_plausibility(self) -> None:
-        """Is called during initialization to warn the user about some
-        possible common configuration mistakes."""
-
-        _state = self.app.get_state(self.entity_id, attribute="all")
-        if not _state:
-            self.log("Thermostat couldn't be found.", level="WARNING")
-            return
+    def _restore_stored_state(self) -> None:
+        """Restores the wanted temperature and resumes re-sending it,
+        if that was in progress, from the app's state store."""
 
-        state = copy.deepcopy(_state or {})  # type: T.Dict[str, T.Any]
-        state.update((state or {}).get("attributes", {}))
-
-        required_attrs = []
-        if self.cfg["supports_opmodes"]:
-            required_attrs.append(self.cfg["opmode_state_attr"])
-        if self.cfg["supports_temps"]:
-            required_attrs.append(self.cfg["target_temp_state_attr"])
-        if not required_attrs:
-            self.log("At least one of supports_opmodes and "
-                     "supports_temps should be enabled. "
-                     "Please check your config!",
-                     level="WARNING")
-        for attr in required_attrs:
-            if attr not in state:
-                self.log("Thermostat has no attribute named {}. "
-                         "Available attributes are {}. "
-                         "Please check your config!"
-                         .format(repr(attr), list(state.keys())),
-                         level="WARNING")
-
-        if self.cfg["supports_temps"]:
-            temp_attrs = [self.cfg["target_temp_state_attr"]]
-            if self.cfg["current_temp_state_attr"]:
-                temp_attrs.append(self.cfg["current_temp_state_attr"])
-            for attr in temp_attrs:
-                value = state.get(attr)
-                try:
-                    value = float(value)  # type: ignore
-                except (TypeError, ValueError):
-                    self.log("The value {} for attribute {} is no valid "
-                             "temperature value. "
-                             "Please check your config!"
-                             .format(repr(value), repr(attr)),
-                             level="WARNING")
-
-        allowed_opmodes = state.get("operation_list")
-        if not self.cfg["supports_opmodes"]:
-            if allowed_opmodes:
-                self.log("Operation mode support has been disabled, "
-                         "but the following modes seem to be supported: {} "
-                         "Maybe disabling it was a mistake?"
-                         .format(allowed_opmodes),
-                         level="WARNING")
+        wanted_temp = self.app.stored_state.get(self._store_key("wanted_temp"))
+        try:
+            self.wanted_temp = expr.Temp(wanted_temp)
+        except ValueError:
             return
+        self.log("Restored wanted temperature {}.", self.wanted_temp,
+                 level="DEBUG")
 
-        if self.cfg["opmode_state_attr"] != "operation_mode":
-            # we can't rely on operation_list in this case
+        resend = self.app.stored_state.get(self._store_key("resend"))
+        if resend is None:
             return
-        if not allowed_opmodes:
-            self.log("Attributes for thermostat contain no "
-                     "'operation_list', Consider disabling "
-                     "operation mode support.",
-                     level="WARNING")
+        if self.current_target_temp == self.wanted_temp:
+            self.app.store_state(self._store_key("resend"), None)
             return
-        for opmode in (self.cfg["opmode_heat"], self.cfg["opmode_off"]):
-            if opmode not in allowed_opmodes:
-                self.log("Thermostat doesn't seem to support the "
-                         "operation mode {}, supported modes are: {}. "
-                         "Please check your config!"
-                         .format(opmode, allowed_opmodes),
-                         level="WARNING")
+        self.log("Resuming re-sending.",
+                 level="DEBUG")
+        self._schedule_resend(
+            resend["opmode"],
+            expr.Temp(resend["temp"]) if resend["temp"] is not None else None,
+            resend["left_retries"], resend.get("attempt", 0)
+        )
+
+    def _schedule_resend(
+            self, opmode: T.Optional[str], temp: T.Optional[expr.Temp],
+            left_retries: int, attempt: int
+    ) -> None:
+        """Plans re-sending the given operation mode and temperature
+        with the app's retry scheduler. attempt is the number of the
+        retry, starting at 0, which determines the delay."""
+
+        delay = retry.get_retry_delay(
+            self.cfg["set_temp_retry_interval"],
+            self.cfg["set_temp_retry_backoff"],
+            self.cfg["set_temp_retry_max_interval"],
+            attempt
+        )
+        self.log("Re-sending in {:.1f} seconds.", delay,
+                 level="DEBUG")
+        self._resend = {
+            "left_retries": left_retries,
+            "opmode": opmode,
+            "temp": temp,
+            "attempt": attempt,
+        }
+        self.resend_at = self.app.datetime() + \
+                         datetime.timedelta(seconds=delay)
+        self.app.retry_scheduler.schedule(self, self.resend_at)
+        self.app.store_state(self._store_key("resend"), {
+            "left_retries": left_retries,
+            "opmode": opmode,
+            "temp": temp.serialize() if temp is not None else None,
+            "attempt": attempt,
+        })
 
     def _state_cb(
             self, entity: str, attr: str,
@@ -116,16 +119,31 @@ class Thermostat:
     ) -> None:
         """Is called when the thermostat's state changes.
         This method fetches both the current and target temperature from
-        the thermostat and reacts accordingly."""
-
-        attrs = copy.deepcopy(new or {})
-        attrs.update((attrs or {}).get("attributes", {}))
+        the thermostat and reacts accordingly.
+        Changes not affecting any of the attributes Heaty reads are
+        dropped right away, unless a re-send is pending, which a
+        report of the wanted temperature confirms. Pass None as old to
+        handle new in any case."""
+
+        stats = self.app.thermostat_state_stats
+        attrs = util.state_view(new)
+        if old is not None and self.resend_at is None:
+            old_attrs = util.state_view(old)
+            if all(attrs.get(attr) == old_attrs.get(attr)
+                   for attr in self._relevant_attrs):
+                stats["filtered"] += 1
+                self.log("No relevant attribute changed, ignoring state "
+                         "change ({} ignored, {} handled in total).",
+                         stats["filtered"], stats["handled"],
+                         level="DEBUG")
+                return
+        stats["handled"] += 1
 
         _target_temp = None  # type: T.Optional[expr.TempValueType]
-        if self.cfg["supports_opmodes"]:
-            opmode = attrs.get(self.cfg["opmode_state_attr"])
-            self.log("Attribute {} is {}."
-                     .format(repr(self.cfg["opmode_state_attr"]), repr(opmode)),
+        if self._opmode_attr is not None:
+            opmode = attrs.get(self._opmode_attr)
+            self.log("Attribute {!r} is {!r}.",
+                     self._opmode_attr, opmode,
                      level="DEBUG", prefix=common.LOG_PREFIX_INCOMING)
             if opmode == self.cfg["opmode_off"]:
                 _target_temp = expr.Off()
@@ -137,11 +155,10 @@ class Thermostat:
             opmode = None
 
         if _target_temp is None:
-            if self.cfg["supports_temps"]:
-                _target_temp = attrs.get(self.cfg["target_temp_state_attr"])
-                self.log("Attribute {} is {}."
-                         .format(repr(self.cfg["target_temp_state_attr"]),
-                                 repr(_target_temp)),
+            if self._target_temp_attr is not None:
+                _target_temp = attrs.get(self._target_temp_attr)
+                self.log("Attribute {!r} is {!r}.",
+                         self._target_temp_attr, _target_temp,
                          level="DEBUG", prefix=common.LOG_PREFIX_INCOMING)
             else:
                 _target_temp = 0
@@ -153,11 +170,11 @@ class Thermostat:
                      level="ERROR")
             return
 
-        current_temp_attr = self.cfg["current_temp_state_attr"]
-        if current_temp_attr and self.cfg["supports_temps"]:
+        current_temp_attr = self._current_temp_attr
+        if current_temp_attr:
             _current_temp = attrs.get(current_temp_attr)
-            self.log("Attribute {} is {}."
-                     .format(repr(current_temp_attr), repr(_current_temp)),
+            self.log("Attribute {!r} is {!r}.",
+                     current_temp_attr, _current_temp,
                      level="DEBUG", prefix=common.LOG_PREFIX_INCOMING)
             try:
                 current_temp = expr.Temp(_current_temp)  # type: T.Optional[expr.Temp]
@@ -172,7 +189,7 @@ class Thermostat:
                     )
 
         if target_temp == self.wanted_temp:
-            self.cancel_resend_timer()
+            self.cancel_resend()
 
         if target_temp != self.current_target_temp:
             if self.cfg["supports_temps"]:
@@ -189,55 +206,193 @@ class Thermostat:
                 "target_temp_changed", self, target_temp
             )
 
-    def initialize(self) -> None:
-        """Should be called in order to register state listeners and
-        timers."""
+    def _store_key(self, param: str) -> str:
+        """Returns the key to store the given parameter under in the
+        app's state store."""
 
-        self.log("Initializing thermostat (entity_id={})."
-                 .format(repr(self.entity_id)),
-                 level="DEBUG")
+        return "thermostat:{}:{}".format(self.entity_id, param)
+
+    def get_status(self) -> T.Dict[str, T.Any]:
+        """Returns a JSON-serializable snapshot of the thermostat's
+        state as tracked in memory."""
 
-        self._check_config_plausibility()
+        return {
+            "current_temp": util.serialize_temp(self.current_temp),
+            "current_target_temp":
+                util.serialize_temp(self.current_target_temp),
+            "wanted_temp": util.serialize_temp(self.wanted_temp),
+            "synced": self.is_synced,
+            "resending": self.resend_at is not None,
+        }
 
-        self.log("Fetching initial state.",
+    def initialize(self, state: T.Optional[T.Dict[str, T.Any]]) -> None:
+        """Should be called in order to register state listeners and
+        timers. state is the thermostat's current state including all
+        attributes, as fetched at startup."""
+
+        self.log("Initializing thermostat (entity_id={!r}).",
+                 self.entity_id,
                  level="DEBUG")
-        state = self.app.get_state(self.entity_id, attribute="all")
+
         if state is None:
             self.log("State for thermostat is None, ignoring it for now.",
                      level="WARNING")
         else:
             # populate self.current_target_temp etc. by simulating a
             # state change
-            self._state_cb(self.entity_id, "all", state, state, {})
+            self._state_cb(self.entity_id, "all", None, state, {})
+
+        if self.app.state_store is not None:
+            self._restore_stored_state()
 
         self.log("Listening for state changes.",
                  level="DEBUG")
-        self.app.listen_state(self._state_cb, self.entity_id, attribute="all")
+        self.app.listen_state(self.room.work_queue.wrap(self._state_cb),
+                              self.entity_id, attribute="all")
 
     def log(self, msg: str, *args: T.Any, **kwargs: T.Any) -> None:
-        """Prefixes the thermostat to log messages."""
-        msg = "[{}] {}".format(self, msg)
-        self.room.log(msg, *args, **kwargs)
+        """Prefixes the thermostat to log messages.
+        Nothing is formatted if the message isn't going to be logged."""
 
-    def cancel_resend_timer(self) -> None:
-        """Cancels the resend timer for this thermostat, if one exists."""
+        if not self.app.is_logged(kwargs.get("level", "INFO")):
+            return
+        if args:
+            msg = msg.format(*args)
+        self.room.log("[{}] {}".format(self, msg), **kwargs)
 
-        timer = self.resend_timer
-        if timer is None:
+    def cancel_resend(self) -> None:
+        """Cancels re-sending to this thermostat, if it's planned."""
+
+        if self.resend_at is None:
             return
-        self.app.cancel_timer(timer)
-        self.resend_timer = None
-        self.log("Cancelled resend timer.", level="DEBUG")
+        self.resend_at = None
+        self._resend = None
+        self.app.store_state(self._store_key("resend"), None)
+        self.log("Cancelled re-sending.", level="DEBUG")
+
+    def check_config_plausibility(
+            self, _state: T.Optional[T.Dict[str, T.Any]]
+    ) -> T.List[str]:
+        """Checks the configuration against the given state of the
+        thermostat for some possible common configuration mistakes and
+        returns a description of every problem found."""
+
+        problems = []  # type: T.List[str]
+        if not _state:
+            problems.append("Thermostat couldn't be found.")
+            return problems
+
+        state = util.state_view(_state)
+
+        required_attrs = []
+        if self.cfg["supports_opmodes"]:
+            required_attrs.append(self.cfg["opmode_state_attr"])
+        if self.cfg["supports_temps"]:
+            required_attrs.append(self.cfg["target_temp_state_attr"])
+        if not required_attrs:
+            problems.append("At least one of supports_opmodes and "
+                            "supports_temps should be enabled. "
+                            "Please check your config!")
+        for attr in required_attrs:
+            if attr not in state:
+                problems.append("Thermostat has no attribute named {}. "
+                                "Available attributes are {}. "
+                                "Please check your config!"
+                                .format(repr(attr), list(state.keys())))
+
+        if self.cfg["supports_temps"]:
+            temp_attrs = [self.cfg["target_temp_state_attr"]]
+            if self.cfg["current_temp_state_attr"]:
+                temp_attrs.append(self.cfg["current_temp_state_attr"])
+            for attr in temp_attrs:
+                value = state.get(attr)
+                try:
+                    value = float(value)  # type: ignore
+                except (TypeError, ValueError):
+                    problems.append("The value {} for attribute {} is no "
+                                    "valid temperature value. "
+                                    "Please check your config!"
+                                    .format(repr(value), repr(attr)))
+
+        allowed_opmodes = state.get("operation_list")
+        if not self.cfg["supports_opmodes"]:
+            if allowed_opmodes:
+                problems.append("Operation mode support has been "
+                                "disabled, but the following modes seem "
+                                "to be supported: {} "
+                                "Maybe disabling it was a mistake?"
+                                .format(allowed_opmodes))
+            return problems
+
+        if self.cfg["opmode_state_attr"] != "operation_mode":
+            # we can't rely on operation_list in this case
+            return problems
+        if not allowed_opmodes:
+            problems.append("Attributes for thermostat contain no "
+                            "'operation_list', Consider disabling "
+                            "operation mode support.")
+            return problems
+        for opmode in (self.cfg["opmode_heat"], self.cfg["opmode_off"]):
+            if opmode not in allowed_opmodes:
+                problems.append("Thermostat doesn't seem to support the "
+                                "operation mode {}, supported modes are: {}. "
+                                "Please check your config!"
+                                .format(opmode, allowed_opmodes))
+
+        return problems
+
+    def is_echo(self, target_temp: expr.Temp) -> bool:
+        """Tells whether the given target temperature reported by the
+        thermostat is just the confirmation of a temperature Heaty sent
+        recently, rather than a manual change. Only temperatures sent
+        since the wanted temperature last changed count. They're
+        remembered for as long as they could be re-sent, which means
+        until confirmed or replaced with unlimited retries. Once
+        confirmed, the temperature and all sent before it are
+        forgotten. A manual change makes all of them forgotten."""
+
+        retries = self.cfg["set_temp_retries"]
+        if retries >= 0:
+            interval = max(self.cfg["set_temp_retry_interval"],
+                           self.cfg["set_temp_retry_max_interval"])
+            timeout = datetime.timedelta(
+                seconds=interval * (1 + retry.RETRY_JITTER) * (retries + 1)
+            )
+            now = self.app.datetime()
+            for temp, sent_at in list(self._sent_temps.items()):
+                if now - sent_at > timeout:
+                    del self._sent_temps[temp]
+
+        confirmed_at = self._sent_temps.get(target_temp)
+        if confirmed_at is None:
+            # the manual change supersedes whatever was sent before
+            self._sent_temps.clear()
+            return False
+        for temp, sent_at in list(self._sent_temps.items()):
+            if sent_at <= confirmed_at:
+                del self._sent_temps[temp]
+        return True
 
     @property
     def is_synced(self) -> bool:
         """Tells whether the thermostat's target temperature is the
         wanted temperature and no re-sending is in progress."""
 
-        return self.resend_timer is None and \
+        return self.resend_at is None and \
                self.current_target_temp is not None and \
                self.current_target_temp == self.wanted_temp
 
+    def resend(self, when: datetime.datetime) -> None:
+        """Is called by the app's retry scheduler when a re-send planned
+        for when is due. Nothing is sent if re-sending has been
+        cancelled or planned anew in the meantime."""
+
+        resend = self._resend
+        if resend is None or self.resend_at != when:
+            return
+        self._send(resend["opmode"], resend["temp"], resend["left_retries"],
+                   resend["attempt"] + 1)
+
     def set_temp(
             self, target_temp: expr.Temp, force_resend: bool = False
     ) -> T.Optional[expr.Temp]:
@@ -259,6 +414,10 @@ class Thermostat:
             opmode = self.cfg["opmode_off"]
         else:
             temp = target_temp + self.cfg["delta"]
+            step = self.cfg["temp_step"]
+            if step:
+                # round to the setpoints the thermostat supports
+                temp = expr.Temp(util.round_to_step(float(temp), step))
             if isinstance(self.cfg["min_temp"], expr.Temp) and \
                temp < self.cfg["min_temp"]:
                 temp = None
@@ -287,6 +446,15 @@ class Thermostat:
                      level="DEBUG")
             temp = None
 
+        current = self.current_target_temp
+        if temp is not None and current is not None and \
+           not current.is_off and not target_temp.is_off and \
+           abs(float(temp - current)) < self.cfg["temp_deadband"]:
+            self.log("Keeping target temperature of {} instead of {} "
+                     "due to the deadband.", current, temp,
+                     level="DEBUG")
+            temp = current
+
         if opmode is None and temp is None:
             self.log("Nothing to send to this thermostat.",
                      level="DEBUG")
@@ -298,6 +466,13 @@ class Thermostat:
             wanted_temp = temp
         else:
             wanted_temp = expr.Temp(0)
+        if wanted_temp != self.wanted_temp:
+            # reports of temperatures sent before are no echoes anymore
+            self._sent_temps.clear()
+            self.app.store_state(
+                self._store_key("wanted_temp"),
+                wanted_temp.serialize() if wanted_temp is not None else None
+            )
         self.wanted_temp = wanted_temp
 
         if not force_resend and self.is_synced:
@@ -305,58 +480,61 @@ class Thermostat:
                      level="DEBUG")
             return None
 
-        self.cancel_resend_timer()
-        self._set_temp_resend_cb({
-            "left_retries": self.cfg["set_temp_retries"],
-            "opmode": opmode,
-            "temp": temp,
-        })
+        self.cancel_resend()
+        self._send(opmode, temp, self.cfg["set_temp_retries"])
 
         return wanted_temp
 
-    def _set_temp_resend_cb(self, kwargs: dict) -> None:
-        """This callback sends the operation_mode and temperature to the
-        thermostat. Expected values for kwargs are:
-        - opmode and temp (incl. delta)
-        - left_retries (after this round)"""
-
-        opmode = kwargs["opmode"]
-        temp = kwargs["temp"]
-        left_retries = kwargs["left_retries"]
+    def _send(
+            self, opmode: T.Optional[str], temp: T.Optional[expr.Temp],
+            left_retries: int, attempt: int = 0
+    ) -> None:
+        """Sends the operation mode and temperature (incl. delta) to the
+        thermostat and plans re-sending them as long as retries are
+        left (after this round). attempt is the number of the next
+        retry."""
 
-        self.resend_timer = None
+        self.resend_at = None
+        self._resend = None
 
         self.log("Setting temperature = {}, operation mode = {}, "
-                 "left retries = {}."
-                 .format(temp or "<unset>", repr(opmode) or "<unset>",
-                         left_retries),
+                 "left retries = {}.",
+                 temp or "<unset>", repr(opmode) or "<unset>", left_retries,
                  level="DEBUG", prefix=common.LOG_PREFIX_OUTGOING)
 
-        if opmode is not None:
-            if opmode == self.cfg["opmode_heat"]:
-                opmode_service = self.cfg["opmode_heat_service"]
-                opmode_service_attr = self.cfg["opmode_heat_service_attr"]
-            else:
-                opmode_service = self.cfg["opmode_off_service"]
-                opmode_service_attr = self.cfg["opmode_off_service_attr"]
-            attrs = {"entity_id": self.entity_id}
-            if opmode_service_attr:
-                attrs[opmode_service_attr] = opmode
-            self.app.call_service(opmode_service, **attrs)
-        if temp is not None:
+        combined_attr = self.cfg["target_temp_service_opmode_attr"]
+        if combined_attr and temp is not None and \
+           opmode == self.cfg["opmode_heat"]:
+            # a single call carries both operation mode and temperature
             attrs = {"entity_id": self.entity_id,
-                     self.cfg["target_temp_service_attr"]: temp.value}
-            self.app.call_service(self.cfg["target_temp_service"], **attrs)
+                     self.cfg["target_temp_service_attr"]: temp.value,
+                     combined_attr: opmode}
+            self.app.service_batcher.call_service(
+                self.cfg["target_temp_service"], **attrs
+            )
+        else:
+            if opmode is not None:
+                if opmode == self.cfg["opmode_heat"]:
+                    opmode_service = self.cfg["opmode_heat_service"]
+                    opmode_service_attr = self.cfg["opmode_heat_service_attr"]
+                else:
+                    opmode_service = self.cfg["opmode_off_service"]
+                    opmode_service_attr = self.cfg["opmode_off_service_attr"]
+                attrs = {"entity_id": self.entity_id}
+                if opmode_service_attr:
+                    attrs[opmode_service_attr] = opmode
+                self.app.service_batcher.call_service(opmode_service, **attrs)
+            if temp is not None:
+                attrs = {"entity_id": self.entity_id,
+                         self.cfg["target_temp_service_attr"]: temp.value}
+                self.app.service_batcher.call_service(
+                    self.cfg["target_temp_service"], **attrs
+                )
+        if self.wanted_temp is not None:
+            self._sent_temps[self.wanted_temp] = self.app.datetime()
 
         if not left_retries:
+            self.app.store_state(self._store_key("resend"), None)
             return
 
-        interval = self.cfg["set_temp_retry_interval"]
-        self.log("Re-sending in {} seconds."
-                 .format(interval),
-                 level="DEBUG")
-        timer = self.app.run_in(
-            self._set_temp_resend_cb, interval,
-            left_retries=left_retries - 1,
-            opmode=opmode, temp=temp)
-        self.resend_timer = timer
+        self._schedule_resend(opmode, temp, left_retries - 1, attempt)
@@ -3,10 +3,15 @@ Utility functions that are used everywhere inside Heaty.
 """
 
 import typing as T
+if T.TYPE_CHECKING:
+    # pylint: disable=cyclic-import,unused-import
+    from . import expr
 
 import collections
 import datetime
+import decimal
 import re
+import types
 
 
 # matches any character that is not allowed in Python variable names
@@ -15,6 +20,8 @@ INVALID_VAR_NAME_CHAR_PATTERN = re.compile(r"[^0-9A-Za-z_]")
 RANGE_PATTERN = re.compile(r"^(\d+)\-(\d+)$")
 # strftime-compatible format string for military time
 TIME_FORMAT = "%H:%M:%S"
+# strftime-compatible format string for date and military time
+DATETIME_FORMAT = "%Y-%m-%d {}".format(TIME_FORMAT)
 # regular expression for time formats, group 1 is hours, group 2 is minutes,
 # optional group 3 is seconds
 TIME_REGEXP = re.compile(r"^ *([01]?\d|2[0-3]) *\: *([0-5]\d) *(?:\: *([0-5]\d) *)?$")
@@ -153,3 +160,37 @@ def parse_time_string(time_str: str) -> datetime.time:
                          .format(repr(time_str)))
     components = [int(comp) for comp in match.groups() if comp is not None]
     return datetime.time(*components)  # type: ignore
+
+def round_to_step(value: float, step: float) -> float:
+    """Rounds value to the nearest multiple of step. Values exactly
+    half-way between two multiples are always rounded up, the decimal
+    representations of both numbers are used to avoid binary floating
+    point artifacts.
+
+    >>> round_to_step(20.25, 0.5), round_to_step(20.75, 0.5)
+    (20.5, 21.0)
+    >>> round_to_step(20.15, 0.1), round_to_step(-0.25, 0.5)
+    (20.2, 0.0)
+    """
+
+    _step = decimal.Decimal(str(step))
+    steps = (decimal.Decimal(str(value)) / _step + decimal.Decimal("0.5")) \
+            .to_integral_value(rounding=decimal.ROUND_FLOOR)
+    return float(steps * _step)
+
+def serialize_temp(temp: T.Optional["expr.Temp"]) -> T.Optional[str]:
+    """Serializes the given temperature for JSON output, None is
+    kept."""
+
+    return temp.serialize() if temp is not None else None
+
+def state_view(state: T.Optional[T.Dict[str, T.Any]]) -> T.Mapping[str, T.Any]:
+    """Returns a read-only view of an entity's state as returned by
+    AppDaemon with attribute="all", in which the attributes are merged
+    into the top level, taking precedence over the keys there.
+    Nothing is copied."""
+
+    state = state or {}
+    return types.MappingProxyType(
+        collections.ChainMap(state.get("attributes") or {}, state)
+    )
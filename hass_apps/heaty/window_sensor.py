@@ -23,6 +23,12 @@ class WindowSensor:
         self.app = room.app
         self.events = observable.Observable()  # type: observable.Observable
 
+        open_state = self.cfg["open_state"]
+        if not isinstance(open_state, list):
+            open_state = [open_state]
+        self._open_states = tuple(open_state)
+        self.is_open = False
+
     def __repr__(self) -> str:
         return "<WindowSensor {}, {}>".format(
             str(self), "open" if self.is_open else "closed"
@@ -39,38 +45,47 @@ class WindowSensor:
         """Is called when the window sensor's state has changed.
         This method triggers the opened/closed event."""
 
-        self.log("State is now {}.".format(new),
+        self.log("State is now {}.", new,
                  level="DEBUG", prefix=common.LOG_PREFIX_INCOMING)
 
-        self.events.trigger("open_close", self, self.is_open)
+        if self._update_state(new):
+            self.events.trigger("open_close", self, self.is_open)
+
+    def _update_state(self, state: T.Any) -> bool:
+        """Updates is_open according to the given state of the sensor
+        and returns whether it has changed."""
 
-    def initialize(self) -> None:
+        is_open = state in self._open_states
+        changed = is_open != self.is_open
+        self.is_open = is_open
+        return changed
+
+    def initialize(self, state: T.Any = None) -> None:
         """Should be called in order to register state listeners and
-        timers."""
+        timers. state is the sensor's current state, as fetched at
+        startup."""
 
-        self.log("Initializing window sensor (entity_id={})."
-                 .format(repr(self.entity_id)),
+        self.log("Initializing window sensor (entity_id={!r}).",
+                 self.entity_id,
                  level="DEBUG")
 
-        self.log("Listening for state changes (delay={})."
-                 .format(self.cfg["delay"]),
+        self._update_state(state)
+        self.log("Sensor is {}.", "open" if self.is_open else "closed",
                  level="DEBUG")
-        self.app.listen_state(self._state_cb, self.entity_id,
-                              duration=self.cfg["delay"])
 
-    @property
-    def is_open(self) -> bool:
-        """Tells whether the sensor reports open or not."""
-
-        open_state = self.cfg["open_state"]
-        states = []
-        if isinstance(open_state, list):
-            states.extend(open_state)
-        else:
-            states.append(open_state)
-        return self.app.get_state(self.entity_id) in states
+        self.log("Listening for state changes (delay={}).",
+                 self.cfg["delay"],
+                 level="DEBUG")
+        self.app.listen_state(self.room.work_queue.wrap(self._state_cb),
+                              self.entity_id,
+                              duration=self.cfg["delay"])
 
     def log(self, msg: str, *args: T.Any, **kwargs: T.Any) -> None:
-        """Prefixes the window sensor to log messages."""
-        msg = "[{}] {}".format(self, msg)
-        self.room.log(msg, *args, **kwargs)
+        """Prefixes the window sensor to log messages.
+        Nothing is formatted if the message isn't going to be logged."""
+
+        if not self.app.is_logged(kwargs.get("level", "INFO")):
+            return
+        if args:
+            msg = msg.format(*args)
+        self.room.log("[{}] {}".format(self, msg), **kwargs)
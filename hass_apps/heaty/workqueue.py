@@ -0,0 +1,75 @@
+"""
+This module implements the WorkQueue class, which serializes all work
+done for a single room (or other object) while allowing work for
+different objects to run concurrently in AppDaemon's worker threads.
+"""
+
+import typing as T
+
+import collections
+import functools
+import threading
+import traceback
+
+
+class WorkQueue:
+    """Executes the calls submitted to it one after another, never
+    concurrently.
+    The queue has no thread of its own. A thread submitting a call to
+    an idle queue executes it right away, followed by all calls other
+    threads submitted in the meantime. Calls submitted while the queue
+    is busy are only queued and left for the thread working it off,
+    which also applies to calls submitted from within a queued call."""
+
+    def __init__(self, log: T.Callable[..., None]) -> None:
+        self._log = log
+        self._calls = collections.deque()  # type: T.Deque[T.Tuple[T.Callable, tuple, dict]]
+        self._lock = threading.Lock()
+        self._busy = False
+
+    def __repr__(self) -> str:
+        return "<WorkQueue with {} pending calls{}>".format(
+            len(self._calls), ", busy" if self._busy else ""
+        )
+
+    def _work(self) -> None:
+        """Executes queued calls until the queue is empty.
+        Exceptions are logged and don't stop the remaining calls."""
+
+        while True:
+            with self._lock:
+                if not self._calls:
+                    self._busy = False
+                    return
+                func, args, kwargs = self._calls.popleft()
+            try:
+                func(*args, **kwargs)
+            except Exception:  # pylint: disable=broad-except
+                self._log("Unhandled exception in {}:\n{}"
+                          .format(func, traceback.format_exc()),
+                          level="ERROR")
+
+    def submit(self, func: T.Callable, *args: T.Any, **kwargs: T.Any) -> None:
+        """Queues func to be called with the given arguments. If the
+        queue is idle, the call is executed immediately in the calling
+        thread, otherwise this method returns without waiting for it."""
+
+        with self._lock:
+            self._calls.append((func, args, kwargs))
+            if self._busy:
+                return
+            self._busy = True
+        self._work()
+
+    def wrap(self, func: T.Callable) -> T.Callable[..., None]:
+        """Returns a function which submits calls to func to this queue.
+        It's meant for callbacks registered with AppDaemon, which
+        don't need the return value."""
+
+        @functools.wraps(func)
+        def wrapper(*args: T.Any, **kwargs: T.Any) -> None:
+            """Submits the call to the queue."""
+
+            self.submit(func, *args, **kwargs)
+
+        return wrapper